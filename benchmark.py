@@ -0,0 +1,280 @@
+import gc
+import os
+import sys
+import types
+import json
+import timeit
+import shutil
+import itertools
+import tempfile
+import platform
+import argparse
+from templite import Templite
+
+import vstore
+import gui_parts as GP
+import export
+import search
+
+
+template_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates", "marlin.py")
+baseline_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+template_sizes = (1, 4, 16)
+store_keys = ["KEY_%i" % i for i in range(100)]
+batch_size = 20
+
+
+class _NullWriter(object):
+    def write(self, data):
+        pass
+
+
+def synthetic_settings(count):
+    """
+    generates a fixed list of settings dictionaries for the marlin template.
+    The same count always produces the same data.
+    """
+    settings = []
+    for i in range(count):
+        extruders = 1 + i % 3
+        settings.append({
+            "MOTHERBOARD": (33, 34, 62, 7)[i % 4],
+            "BAUDRATE": (115200, 250000)[i % 2],
+            "BTENABLED": i % 2,
+            "KINEMATIC_CONFIG": i % 2,
+            "X_MAX_POS": 200 + i,
+            "Y_MAX_POS": 200 + 2 * i,
+            "Z_MAX_POS": 180 + 3 * i,
+            "INVERT_X_DIR": bool(i % 2),
+            "X_HOME_DIR": bool(i % 3),
+            "X_STEPS_PER_MM": 78.7402 + i,
+            "Z_MM_PER_S": 5.0 + i % 5,
+            "EXTRUDERS": extruders,
+            "TEMP_SENSOR": [1 + (i + e) % 7 for e in range(extruders)],
+            "HEATER_MINTEMP": [5] * extruders,
+            "HEATER_MAXTEMP": [250 + 5 * e for e in range(extruders)],
+            "INVERT_E_DIR": [bool(e % 2) for e in range(extruders)],
+            "E_STEPS_PER_MM": [836.0 + e for e in range(extruders)],
+            "E_MM_PER_S": [25.0] * extruders,
+            "TEMP_SENSOR_BED": (1, 11, 60)[i % 3],
+        })
+    return settings
+
+
+def _fresh_store(module, settings=None):
+    vstore.instance.clear()
+    module.load_defaults()
+    if settings:
+        vstore.instance.update(settings)
+    return vstore.instance
+
+
+def bench_templite(module):
+    contents = export.load_outputs(module)["configuration.h"]
+    store = _fresh_store(module, synthetic_settings(3)[2])
+    cases = {}
+    for size in template_sizes:
+        source = contents * size
+        template = Templite(source)
+        cases["templite.compile.x%i" % size] = (lambda source=source: Templite(source), 20)
+        cases["templite.render.x%i" % size] = (
+            lambda template=template: template.render(store, **export.helpers), 50)
+    return cases
+
+
+def bench_vstore():
+    plain = vstore.VariableStore()
+    bound = vstore.VariableStore()
+    for key in store_keys:
+        plain[key] = 0
+        bound[key] = 0
+        for i in range(4):
+            bound.add_binding(key, lambda key, value: None)
+    data = dict((key, 1) for key in store_keys)
+    nested = vstore.VariableStore()
+    nested["TEMP_SENSOR"] = [1, 2, 3]
+
+    def set_all(store):
+        for key in store_keys:
+            store[key] = 1
+
+    return {
+        "vstore.set.unbound": (lambda: set_all(plain), 200),
+        "vstore.set.bound": (lambda: set_all(bound), 200),
+        "vstore.update.unbound": (lambda: plain.update(data), 200),
+        "vstore.update.bound": (lambda: bound.update(data), 200),
+        "vstore.getr": (lambda: nested.getr(("TEMP_SENSOR", 1)), 20000),
+        "vstore.setr": (lambda: nested.setr(("TEMP_SENSOR", 1), 5), 20000),
+    }
+
+
+def bench_attribute(module):
+    _fresh_store(module)
+    constant = GP.Attribute("Extruder count")
+    func = GP.Attribute(GP.Func(["EXTRUDERS"], lambda max: max - 1))
+    expr = GP.Attribute(GP.Expr("EXTRUDERS - 1"))
+    return {
+        "attribute.value.constant": (lambda: constant.value, 20000),
+        "attribute.value.func": (lambda: func.value, 20000),
+        "attribute.value.expr": (lambda: expr.value, 20000),
+    }
+
+
+def bench_parts(module):
+    def build():
+        _fresh_store(module)
+        module.load_gui()
+    _fresh_store(module)
+    index = search.SearchIndex(module.load_gui())
+    return {
+        "parts.build_tree": (build, 50),
+        "search.build_index": (lambda: search.SearchIndex(module.load_gui()), 50),
+        "search.query": (lambda: index.query("temp sen"), 20000),
+    }
+
+
+def generated_gui(module, pages):
+    """
+    builds a large part tree from the template's input helpers: one Page per
+    index with a heater group and a few axis style inputs.
+    """
+    tab = GP.Tab("Generated")
+    for i in range(pages):
+        tab.add_child(GP.Page("Heater %i" % i).add_children(
+            GP.OptionsGroup("Sensor type and limits").add_children(
+                module.sensor_type_input("TEMP_SENSOR_%i" % i),
+                module.mintemp_input("MINTEMP_%i" % i),
+                module.maxtemp_input("MAXTEMP_%i" % i),
+            ),
+            GP.OptionsGroup("Motion").add_children(
+                GP.RealInput("Steps per mm", "STEPS_PER_MM_%i" % i, min=0.0, max=1000.0),
+                GP.CheckInput("Invert direction", "INVERT_DIR_%i" % i),
+            ),
+        ))
+    return GP.Notebook().add_child(tab)
+
+
+def deep_size(root):
+    """
+    returns the bytes used by root and everything it references, counting
+    shared objects once. Classes, functions, modules and stores are excluded.
+    """
+    seen = set()
+    stack = [root]
+    total = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, (type, types.ModuleType, types.FunctionType,
+                                               types.BuiltinFunctionType, vstore.VariableStore)):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        stack.extend(gc.get_referents(obj))
+    return total
+
+
+def memory_report(module, sizes=(10, 100, 1000)):
+    """
+    returns a dictionary of "memory.<parts>parts" to bytes per part for
+    generated part trees of increasing size.
+    """
+    report = {}
+    for pages in sizes:
+        _fresh_store(module)
+        root = generated_gui(module, pages)
+        parts = sum(1 for part in search.walk(root))
+        report["memory.parts.x%i" % pages] = deep_size(root) / float(parts)
+    return report
+
+
+def bench_export(module, directory):
+    paths = []
+    for i, settings in enumerate(synthetic_settings(batch_size)):
+        path = os.path.join(directory, "settings_%03i.json" % i)
+        with open(path, "w") as fp:
+            json.dump(settings, fp)
+        paths.append(path)
+    runs = itertools.count()
+    def export_all():
+        #A new directory each time so every file is really written
+        export.export_batch(module, paths, os.path.join(directory, "out%i" % next(runs)))
+    return {"export.batch.x%i" % batch_size: (export_all, 3)}
+
+
+def run(repeat=3):
+    """
+    runs every benchmark and returns a dictionary of name to best seconds per call.
+    """
+    module = export.load_module(template_path)
+    directory = tempfile.mkdtemp(prefix="guiconfig-bench-")
+    results = {}
+    stdout = sys.stdout
+    sys.stdout = _NullWriter() #VariableStore logs every write
+    try:
+        for group in (bench_templite(module), bench_vstore(), bench_attribute(module),
+                      bench_parts(module), bench_export(module, directory)):
+            for name, (fn, number) in sorted(group.items()):
+                best = min(timeit.repeat(fn, number=number, repeat=repeat))
+                results[name] = best / number
+    finally:
+        sys.stdout = stdout
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    returns a list of (name, current, baseline, ratio) for every result that is
+    slower than the baseline by more than threshold.
+    """
+    regressions = []
+    for name, current in sorted(results.items()):
+        previous = baseline.get(name)
+        if previous and current / previous > threshold:
+            regressions.append((name, current, previous, current / previous))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark GuiConfig hot paths")
+    parser.add_argument("-o", "--output", help="write results as JSON to this file")
+    parser.add_argument("-b", "--baseline", default=baseline_path, help="baseline results to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("-t", "--threshold", type=float, default=1.25,
+                        help="slowdown ratio above which a result counts as a regression")
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+    stdout = sys.stdout
+    sys.stdout = _NullWriter()
+    try:
+        memory = memory_report(export.load_module(template_path))
+    finally:
+        sys.stdout = stdout
+    report = {"python": platform.python_version(), "results": results, "memory": memory}
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r") as fp:
+            baseline = json.load(fp)["results"]
+
+    for name, seconds in sorted(results.items()):
+        line = "%-28s %12.3f us" % (name, seconds * 1e6)
+        if name in baseline:
+            line += "  (%.2fx baseline)" % (seconds / baseline[name])
+        print(line)
+
+    for name, size in sorted(memory.items()):
+        print("%-28s %12.0f bytes/part" % (name, size))
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(report, fp, indent=2, sort_keys=True)
+    if args.save_baseline:
+        with open(args.baseline, "w") as fp:
+            json.dump(report, fp, indent=2, sort_keys=True)
+
+    regressions = compare(results, baseline, args.threshold)
+    for name, current, previous, ratio in regressions:
+        print("REGRESSION %s: %.3f us -> %.3f us (%.2fx)" % (name, previous * 1e6, current * 1e6, ratio))
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,168 @@
+import os
+import ast
+import json
+import argparse
+
+import export
+
+#Cached metadata, kept next to the templates
+index_filename = ".guiconfig-catalog.json"
+#Bump when the extracted metadata changes shape
+version = 1
+
+
+def _calls(node, functions, seen):
+    #Yields the calls below node in source order, following calls to module level functions
+    if isinstance(node, ast.Call):
+        for child in ast.iter_child_nodes(node.func):
+            for call in _calls(child, functions, seen):
+                yield call
+        yield node
+        if isinstance(node.func, ast.Name) and node.func.id in functions and node.func.id not in seen:
+            seen.add(node.func.id)
+            for call in _calls(functions[node.func.id], functions, seen):
+                yield call
+        children = node.args + [keyword.value for keyword in node.keywords]
+    else:
+        children = ast.iter_child_nodes(node)
+    for child in children:
+        for call in _calls(child, functions, seen):
+            yield call
+
+
+def _called_name(call):
+    func = call.func
+    return func.attr if isinstance(func, ast.Attribute) else getattr(func, "id", None)
+
+
+def _string(node):
+    return node.s if isinstance(node, ast.Str) else None
+
+
+def scan(path):
+    """
+    returns the metadata of a template module without importing it: its
+    name, output names, the Tab/Page structure built by load_gui and how
+    many settings load_defaults fills in.
+    """
+    with open(path, "r") as fp:
+        source = fp.read()
+    if source.startswith("\xef\xbb\xbf"):
+        source = source[3:]
+    tree = ast.parse(source, path)
+    functions = dict((node.name, node) for node in tree.body if isinstance(node, ast.FunctionDef))
+    lists = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and isinstance(node.value, (ast.List, ast.Tuple)):
+            for target in node.targets:
+                if isinstance(target, ast.Name):
+                    lists[target.id] = node.value
+
+    docstring = ast.get_docstring(tree)
+    entry = {
+        "name": docstring.splitlines()[0] if docstring else os.path.splitext(os.path.basename(path))[0],
+        "outputs": [],
+        "tabs": [],
+        "defaults": 0,
+    }
+
+    #Outputs are the string keys of the dictionary load_outputs returns
+    if "load_outputs" in functions:
+        for node in ast.walk(functions["load_outputs"]):
+            if isinstance(node, ast.Return) and isinstance(node.value, ast.Dict):
+                entry["outputs"] = sorted(_string(key) for key in node.value.keys if _string(key))
+
+    if "load_gui" in functions:
+        tab = None
+        for call in _calls(functions["load_gui"], functions, set(["load_gui"])):
+            name = _called_name(call)
+            title = _string(call.args[0]) if call.args else None
+            if name == "Tab" and title is not None:
+                tab = {"title": title, "pages": []}
+                entry["tabs"].append(tab)
+            elif name == "Page" and title is not None:
+                if tab is None:
+                    tab = {"title": None, "pages": []}
+                    entry["tabs"].append(tab)
+                tab["pages"].append(title)
+
+    #Settings are the keys of dictionaries passed to update() plus IndexedGroup fields
+    if "load_defaults" in functions:
+        for call in _calls(functions["load_defaults"], functions, set(["load_defaults"])):
+            name = _called_name(call)
+            if name == "update" and call.args and isinstance(call.args[0], ast.Dict):
+                entry["defaults"] += len(call.args[0].keys)
+            elif name == "IndexedGroup" and call.args:
+                fields = call.args[0]
+                if isinstance(fields, ast.Name):
+                    fields = lists.get(fields.id)
+                if isinstance(fields, (ast.List, ast.Tuple)):
+                    entry["defaults"] += len(fields.elts)
+    return entry
+
+
+class Catalog(object):
+    """
+    the metadata of every template in a directory, cached in a JSON index
+    and only rescanned for files whose size or modification time changed.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, index_filename)
+        try:
+            with open(self.path, "r") as fp:
+                index = json.load(fp)
+            self.entries = index["templates"] if index.get("version") == version else {}
+        except (IOError, ValueError, KeyError):
+            self.entries = {}
+        self.scanned = 0
+
+    def refresh(self):
+        """
+        rescans changed templates, drops deleted ones and saves the index.
+        Returns the list of entries sorted by name.
+        """
+        changed = False
+        found = set()
+        for filename in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, filename)
+            if not filename.endswith(".py") or filename.startswith(("_", ".")) or not os.path.isfile(path):
+                continue
+            found.add(filename)
+            info = os.stat(path)
+            entry = self.entries.get(filename)
+            if entry and entry["size"] == info.st_size and entry["mtime"] == info.st_mtime:
+                continue
+            try:
+                entry = scan(path)
+            except SyntaxError as e:
+                entry = {"name": filename, "outputs": [], "tabs": [], "defaults": 0, "error": str(e)}
+            entry.update({"file": filename, "size": info.st_size, "mtime": info.st_mtime})
+            self.entries[filename] = entry
+            self.scanned += 1
+            changed = True
+        for filename in set(self.entries) - found:
+            del self.entries[filename]
+            changed = True
+        if changed:
+            try:
+                export.atomic_write(self.path, json.dumps({"version": version, "templates": self.entries},
+                                                          indent=1, sort_keys=True))
+            except (IOError, OSError):
+                pass #A read-only template directory is scanned every time
+        return sorted(self.entries.values(), key=lambda entry: entry["name"].lower())
+
+    def describe(self, entry):
+        pages = sum(len(tab["pages"]) for tab in entry["tabs"])
+        return "%s - %s (%i pages, %i settings)" % (entry["name"], ", ".join(entry["outputs"]) or "no outputs",
+                                                    pages, entry["defaults"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List the templates in a directory")
+    parser.add_argument("directory", nargs="?", default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                     "templates"))
+    args = parser.parse_args()
+    catalog = Catalog(args.directory)
+    for entry in catalog.refresh():
+        print("%-20s %s" % (entry["file"], catalog.describe(entry)))
@@ -0,0 +1,354 @@
+import os
+import re
+import json
+import mmap
+import struct
+import sqlite3
+import argparse
+import multiprocessing
+
+import vstore
+import export
+
+_schema = """
+CREATE TABLE IF NOT EXISTS configs (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL);
+CREATE TABLE IF NOT EXISTS settings (
+    config INTEGER NOT NULL REFERENCES configs(id) ON DELETE CASCADE,
+    key TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    value,
+    kind TEXT
+);
+CREATE INDEX IF NOT EXISTS settings_value ON settings (key, idx, value);
+CREATE INDEX IF NOT EXISTS settings_config ON settings (config);
+"""
+
+#Scalar settings are stored with idx -1; list items with their index
+scalar = -1
+
+_condition = re.compile(r"^\s*(\w+)(?:\[(\d+|\*)\])?\s*(==|=|!=|<=|>=|<|>)\s*(.*?)\s*$")
+_operators = {"=": "=", "==": "=", "!=": "!=", "<": "<", ">": ">", "<=": "<=", ">=": ">="}
+
+
+def flatten(settings):
+    """
+    yields (key, index, value, kind) rows for a settings dictionary. Lists
+    such as TEMP_SENSOR become one row per item. SQLite has no booleans, so
+    they are stored as 0/1 with kind "bool"; other nested values are stored
+    as JSON text with kind "json".
+    """
+    for key, value in settings.items():
+        if isinstance(value, (list, tuple, vstore.Column)):
+            for index, item in enumerate(value):
+                yield (key, index) + _column_value(item)
+        else:
+            yield (key, scalar) + _column_value(value)
+
+
+def _column_value(value):
+    if isinstance(value, bool):
+        return value, "bool"
+    if value is None or isinstance(value, (int, long, float, basestring)):
+        return value, None
+    return json.dumps(value, default=vstore.to_json), "json"
+
+
+def _python_value(value, kind):
+    if kind == "bool":
+        return bool(value)
+    if kind == "json":
+        return json.loads(value)
+    return value
+
+
+def parse_condition(text):
+    """
+    parses "KEY=VALUE", "KEY[1]>=VALUE" or "KEY[*]=VALUE" (any index) into
+    (key, index, operator, value). Values are read as JSON where possible,
+    so true/false match saved booleans.
+    """
+    match = _condition.match(text)
+    if match is None:
+        raise ValueError("cannot parse condition %r" % text)
+    key, index, operator, value = match.groups()
+    try:
+        value = json.loads(value)
+    except ValueError:
+        pass
+    if index is None:
+        index = scalar
+    elif index != "*":
+        index = int(index)
+    return key, index, _operators[operator], value
+
+
+class Corpus(object):
+    """
+    a SQLite database of many saved settings documents, stored one row per
+    (document, key, index) with an index on (key, index, value) so queries
+    such as EXTRUDERS=2 TEMP_SENSOR_BED=1 do not read every document.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.executescript(_schema)
+
+    def close(self):
+        self.db.close()
+
+    def ingest(self, documents):
+        """
+        stores (name, settings) pairs in one transaction, replacing documents
+        of the same name. Returns the number stored.
+        """
+        count = 0
+        with self.db:
+            for name, settings in documents:
+                self.db.execute("DELETE FROM configs WHERE name = ?", (name,))
+                config = self.db.execute("INSERT INTO configs (name) VALUES (?)", (name,)).lastrowid
+                self.db.executemany("INSERT INTO settings (config, key, idx, value, kind) VALUES (?, ?, ?, ?, ?)",
+                                    ((config,) + row for row in flatten(settings)))
+                count += 1
+        return count
+
+    def ingest_files(self, paths, batch=1000):
+        """
+        stores saved settings files, named after the file, committing every
+        batch files. Returns the number stored.
+        """
+        count = 0
+        documents = []
+        for path in paths:
+            with open(path, "r") as fp:
+                documents.append((os.path.splitext(os.path.basename(path))[0], json.load(fp)))
+            if len(documents) >= batch:
+                count += self.ingest(documents)
+                documents = []
+        return count + self.ingest(documents)
+
+    def query(self, conditions):
+        """
+        returns the names of the documents matching every condition, where a
+        condition is a (key, index, operator, value) tuple as returned by
+        parse_condition.
+        """
+        selects = []
+        parameters = []
+        for key, index, operator, value in conditions:
+            if index == "*":
+                selects.append("SELECT config FROM settings WHERE key = ? AND idx >= 0 AND value %s ?" % operator)
+                parameters.extend([key, value])
+            else:
+                selects.append("SELECT config FROM settings WHERE key = ? AND idx = ? AND value %s ?" % operator)
+                parameters.extend([key, index, value])
+        sql = "SELECT name FROM configs"
+        if selects:
+            sql += " WHERE id IN (%s)" % " INTERSECT ".join(selects)
+        return [name for name, in self.db.execute(sql + " ORDER BY name", parameters)]
+
+    def load(self, name):
+        """
+        returns the settings dictionary stored under name.
+        """
+        settings = {}
+        lists = {}
+        rows = self.db.execute("SELECT key, idx, value, kind FROM settings JOIN configs ON configs.id = config "
+                               "WHERE name = ? ORDER BY key, idx", (name,))
+        for key, index, value, kind in rows:
+            value = _python_value(value, kind)
+            if index == scalar:
+                settings[key] = value
+            else:
+                lists.setdefault(key, []).append(value)
+        settings.update(lists)
+        return settings
+
+    def documents(self, names):
+        """
+        yields (name, settings) for each name, ready for export.export_documents.
+        """
+        for name in names:
+            yield name, self.load(name)
+
+
+_offset = struct.Struct("<Q")
+#Index files start with the size, mtime and ctime of the corpus file they were made for
+_header = struct.Struct("<8sQdd")
+_magic = "GCJSONL1"
+
+
+def _stamp(info):
+    return _header.pack(_magic, info.st_size, info.st_mtime, info.st_ctime)
+
+
+def _write_index(path, info, offsets):
+    export.atomic_write(path + ".idx", _stamp(info) + "".join(_offset.pack(offset) for offset in offsets))
+
+
+def write_jsonl(path, documents):
+    """
+    writes (name, settings) documents to path, one JSON array per line, plus
+    an index of line offsets in path + ".idx". Returns the document count.
+    """
+    offsets = []
+    with open(path, "wb") as fp:
+        for name, settings in documents:
+            offsets.append(fp.tell())
+            fp.write(json.dumps([name, settings], separators=(",", ":"), default=vstore.to_json) + "\n")
+        offsets.append(fp.tell())
+    _write_index(path, os.stat(path), offsets)
+    return len(offsets) - 1
+
+
+class JsonlCorpus(object):
+    """
+    a read-only corpus of one (name, settings) document per line, mapped into
+    memory. The offset index gives random access to any document, and only
+    the lines that are read get copied out of the map and parsed.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        #The open file's own details, in case path is replaced meanwhile
+        info = os.fstat(self._file.fileno())
+        size = info.st_size
+        #mmap cannot map an empty file
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else ""
+        self.offsets = self._load_index(info)
+
+    def _load_index(self, info):
+        size = info.st_size
+        try:
+            with open(self.path + ".idx", "rb") as fp:
+                data = fp.read()
+            #Same-length rewrites keep the last offset, so the file's times must match too
+            if data[:_header.size] == _stamp(info):
+                data = data[_header.size:]
+                offsets = struct.unpack("<%iQ" % (len(data) // _offset.size), data)
+                if offsets and offsets[-1] == size:
+                    return offsets
+        except (IOError, struct.error):
+            pass
+        #Missing or stale: find the line starts again and keep them for next time
+        offsets = [0]
+        position = self._map.find("\n")
+        while position != -1:
+            offsets.append(position + 1)
+            position = self._map.find("\n", position + 1)
+        if offsets[-1] != size:
+            offsets.append(size)
+        offsets = tuple(offsets) if size else (0,)
+        try:
+            _write_index(self.path, info, offsets)
+        except (IOError, OSError):
+            pass
+        return offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("corpus index out of range")
+        name, settings = json.loads(self._map[self.offsets[index]:self.offsets[index + 1]])
+        return name, settings
+
+    def slice(self, start, stop):
+        """
+        yields the documents from start up to stop.
+        """
+        for index in xrange(start, min(stop, len(self))):
+            yield self[index]
+
+    def close(self):
+        if self._map:
+            self._map.close()
+        self._file.close()
+
+
+_worker = {}
+
+
+def _init_export(template_path, corpus_path, directory, sandbox):
+    module = export.load_module(template_path)
+    _worker.update(module=module, corpus=JsonlCorpus(corpus_path), directory=directory,
+                   templates=export.compile_outputs(export.load_outputs(module), module.__file__, sandbox))
+
+
+def _export_range(bounds):
+    written = skipped = 0
+    for name, settings in _worker["corpus"].slice(*bounds):
+        manifest = export.export_settings(_worker["module"], _worker["templates"], name, settings,
+                                          _worker["directory"])
+        written += manifest.written
+        skipped += manifest.skipped
+    return written, skipped
+
+
+def export_jsonl(template_path, path, directory, processes=None, chunk=64, sandbox=False):
+    """
+    exports every document of a JSONL corpus across worker processes. Each
+    worker maps the corpus itself and parses only the ranges of chunk
+    documents it is given. Returns (written, skipped) file counts.
+    """
+    corpus = JsonlCorpus(path)
+    ranges = [(start, start + chunk) for start in xrange(0, len(corpus), chunk)]
+    corpus.close()
+    pool = multiprocessing.Pool(processes, _init_export, (template_path, path, directory, sandbox))
+    try:
+        results = pool.map(_export_range, ranges)
+    finally:
+        pool.close()
+        pool.join()
+    return sum(written for written, skipped in results), sum(skipped for written, skipped in results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Store and query many saved settings files")
+    parser.add_argument("database", help="SQLite corpus file, or a .jsonl corpus for pack and export")
+    commands = parser.add_subparsers(dest="command")
+    ingest = commands.add_parser("ingest", help="add saved settings JSON files")
+    ingest.add_argument("settings", nargs="+")
+    query = commands.add_parser("query", help="list documents matching every condition")
+    query.add_argument("conditions", nargs="*", help='e.g. EXTRUDERS=2 "TEMP_SENSOR[*]=1"')
+    query.add_argument("--export", metavar="TEMPLATE", help="render the matching documents with this template")
+    query.add_argument("--jsonl", help="write the matching documents to this JSONL corpus")
+    query.add_argument("-o", "--output", default=".", help="output directory for --export")
+    query.add_argument("-j", "--threads", type=int, default=1, help="documents to export at once")
+    pack = commands.add_parser("pack", help="write saved settings JSON files into a JSONL corpus")
+    pack.add_argument("settings", nargs="+")
+    export_command = commands.add_parser("export", help="render every document of a JSONL corpus")
+    export_command.add_argument("template", help="template module, e.g. templates/marlin.py")
+    export_command.add_argument("-o", "--output", default=".", help="output directory")
+    export_command.add_argument("-j", "--processes", type=int, help="worker processes (default: one per CPU)")
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        documents = ((os.path.splitext(os.path.basename(path))[0], json.load(open(path, "r")))
+                     for path in args.settings)
+        print("packed %i documents" % write_jsonl(args.database, documents))
+    elif args.command == "export":
+        written, skipped = export_jsonl(args.template, args.database, args.output, args.processes)
+        print("exported %i files, %i unchanged" % (written, skipped))
+    else:
+        corpus = Corpus(args.database)
+        if args.command == "ingest":
+            print("ingested %i documents" % corpus.ingest_files(args.settings))
+        else:
+            names = corpus.query([parse_condition(condition) for condition in args.conditions])
+            if args.jsonl:
+                print("packed %i documents" % write_jsonl(args.jsonl, corpus.documents(names)))
+            if args.export:
+                written, skipped = export.export_documents(export.load_module(args.export),
+                                                           list(corpus.documents(names)),
+                                                           args.output, threads=args.threads)
+                print("exported %i files, %i unchanged" % (written, skipped))
+            elif not args.jsonl:
+                for name in names:
+                    print(name)
+        corpus.close()
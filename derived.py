@@ -0,0 +1,287 @@
+import ast
+import sys
+import json
+import argparse
+import operator
+from collections import Counter
+
+try:
+    import numpy
+except ImportError:
+    numpy = None #Every value is then computed row by row
+
+import vstore
+import export
+import search
+import gui_parts as GP
+from benchmark import _NullWriter
+
+#Integer results that could leave this range are computed row by row, where Python ints cannot overflow
+int_limit = 2 ** 62
+
+_arithmetic = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul}
+_comparisons = {ast.Eq: operator.eq, ast.NotEq: operator.ne, ast.Lt: operator.lt,
+                ast.LtE: operator.le, ast.Gt: operator.gt, ast.GtE: operator.ge}
+
+
+class SettingsTable(object):
+    """
+    settings of many documents stored by key: columns[key][row] is the
+    value of key in document row. List settings such as TEMP_SENSOR hold a
+    list per row.
+    """
+    def __init__(self, columns, names=None):
+        self.columns = columns
+        self.rows = len(next(iter(columns.values()))) if columns else 0
+        self.names = names or range(self.rows)
+        self._arrays = {}
+
+    @classmethod
+    def from_documents(cls, module, documents):
+        """
+        builds a table from (name, settings) pairs, filling in the template
+        defaults for missing keys the way load_settings would. Keys only
+        some documents have are None in the others.
+        """
+        defaults = export.load_settings(module, {})
+        names = []
+        rows = []
+        for name, settings in documents:
+            names.append(name)
+            rows.append(settings)
+        keys = set(defaults)
+        for settings in rows:
+            keys.update(settings)
+        columns = {}
+        for key in keys:
+            default = defaults.get(key)
+            if isinstance(default, vstore.Column):
+                #Lists are coerced to the column type, as assigning to the store would
+                columns[key] = [[default.kind(value) for value in settings[key]] if key in settings
+                                else default.tolist() for settings in rows]
+            else:
+                columns[key] = [settings.get(key, default) for settings in rows]
+        return cls(columns, names)
+
+    @classmethod
+    def from_stores(cls, stores, names=None):
+        keys = set()
+        for store in stores:
+            keys.update(store)
+        columns = dict((key, [json.loads(json.dumps(store.get(key), default=vstore.to_json)) for store in stores])
+                       for key in keys)
+        return cls(columns, names)
+
+    def row(self, index, keys):
+        return dict((key, self.columns[key][index]) for key in keys)
+
+    def array(self, key, item=None):
+        """
+        returns (array, kind, bounds) for a column, or for item of a list
+        column, when every row holds a value of the same numeric type, else
+        None. kind is int, float or bool and bounds is (min, max).
+        """
+        cache_key = (key, item)
+        try:
+            return self._arrays[cache_key]
+        except KeyError:
+            pass
+        values = self.columns.get(key)
+        result = None
+        if values is not None and item is not None:
+            if all(isinstance(value, list) and len(value) > item for value in values):
+                values = [value[item] for value in values]
+            else:
+                values = None
+        if values:
+            kinds = set(type(value) for value in values)
+            if kinds == set([int]) and -int_limit < min(values) and max(values) < int_limit:
+                result = numpy.array(values, dtype=numpy.int64), int, (min(values), max(values))
+            elif kinds == set([float]):
+                result = numpy.array(values, dtype=numpy.float64), float, None
+            elif kinds == set([bool]):
+                result = numpy.array(values, dtype=numpy.bool_), bool, None
+        self._arrays[cache_key] = result
+        return result
+
+
+class _RowByRow(Exception):
+    pass
+
+
+class Error(object):
+    """
+    the value of a row whose evaluation raised, e.g. TEMP_SENSOR[1] in a
+    document with one extruder. Compares equal to errors of the same type.
+    """
+    __slots__ = ("error",)
+
+    def __init__(self, error):
+        self.error = error
+
+    def __eq__(self, other):
+        return isinstance(other, Error) and type(other.error) is type(self.error)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "<%s: %s>" % (type(self.error).__name__, self.error)
+
+
+class Evaluator(object):
+    """
+    computes Func and Expr values for every row of a SettingsTable. An Expr
+    made only of names, constant list items, +, -, *, comparisons, not and
+    "a if b else c" over numeric columns is computed on whole NumPy arrays;
+    everything else is called once per row, like Attribute.value would be.
+    """
+    def __init__(self, table):
+        self.table = table
+        self.vectorised = 0
+        self.per_row = 0
+        self.errors = 0
+        self._results = {}
+
+    def evaluate(self, func):
+        """
+        returns the list of values of func for every row of the table. Rows
+        whose evaluation raises get an Error instead of ending the run.
+        """
+        try:
+            return self._results[id(func)][1]
+        except KeyError:
+            pass
+        values = None
+        if numpy is not None and isinstance(func, GP.Expr) and func.vars:
+            try:
+                array, kind, bounds = self._vector(ast.parse(func.source.strip(), mode="eval").body)
+                values = array.tolist()
+                self.vectorised += 1
+            except _RowByRow:
+                pass
+        if values is None:
+            values = []
+            for index in xrange(self.table.rows):
+                try:
+                    values.append(func(self.table.row(index, func.vars)))
+                except TypeError:
+                    values.append(func) #What Attribute.value returns for a Func it cannot call
+                except Exception as error:
+                    values.append(Error(error))
+                    self.errors += 1
+            self.per_row += 1
+        #Keep func alive so its id is not reused by another one
+        self._results[id(func)] = (func, values)
+        return values
+
+    def _vector(self, node):
+        #Returns (array, kind, bounds) for node or raises _RowByRow
+        if isinstance(node, ast.Name):
+            return self._column(node.id)
+        if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name) and \
+                isinstance(node.slice, ast.Index) and isinstance(node.slice.value, ast.Num) and \
+                type(node.slice.value.n) is int and node.slice.value.n >= 0:
+            return self._column(node.value.id, node.slice.value.n)
+        if isinstance(node, ast.Num):
+            if type(node.n) is int and abs(node.n) < int_limit:
+                return node.n, int, (node.n, node.n)
+            if type(node.n) is float:
+                return node.n, float, None
+        elif isinstance(node, ast.UnaryOp):
+            operand, kind, bounds = self._vector(node.operand)
+            if isinstance(node.op, ast.Not):
+                return numpy.logical_not(operand), bool, None
+            if kind is not bool and isinstance(node.op, ast.USub):
+                return -operand, kind, bounds and (-bounds[1], -bounds[0])
+            if kind is not bool and isinstance(node.op, ast.UAdd):
+                return operand, kind, bounds
+        elif isinstance(node, ast.BinOp) and type(node.op) in _arithmetic:
+            left, left_kind, left_bounds = self._vector(node.left)
+            right, right_kind, right_bounds = self._vector(node.right)
+            #numpy treats bools as logical values, Python as 0 and 1
+            if bool not in (left_kind, right_kind):
+                if float in (left_kind, right_kind):
+                    return _arithmetic[type(node.op)](left, right), float, None
+                bounds = _bounds(type(node.op), left_bounds, right_bounds)
+                if -int_limit < bounds[0] and bounds[1] < int_limit:
+                    return _arithmetic[type(node.op)](left, right), int, bounds
+        elif isinstance(node, ast.Compare) and len(node.ops) == 1 and type(node.ops[0]) in _comparisons:
+            left = self._vector(node.left)[0]
+            right = self._vector(node.comparators[0])[0]
+            return numpy.asarray(_comparisons[type(node.ops[0])](left, right)), bool, None
+        elif isinstance(node, ast.IfExp):
+            test = self._vector(node.test)[0]
+            body, kind, body_bounds = self._vector(node.body)
+            orelse, orelse_kind, orelse_bounds = self._vector(node.orelse)
+            #Both branches must give the same type, as each row only sees one of them
+            if kind is orelse_kind:
+                bounds = body_bounds and orelse_bounds and (min(body_bounds[0], orelse_bounds[0]),
+                                                            max(body_bounds[1], orelse_bounds[1]))
+                return numpy.where(numpy.asarray(test, dtype=bool), body, orelse), kind, bounds
+        raise _RowByRow()
+
+    def _column(self, key, item=None):
+        column = self.table.array(key, item)
+        if column is None:
+            raise _RowByRow()
+        return column
+
+
+def _bounds(op, left, right):
+    #The range of an integer + - * of two ranges
+    if op is ast.Add:
+        return left[0] + right[0], left[1] + right[1]
+    if op is ast.Sub:
+        return left[0] - right[1], left[1] - right[0]
+    products = [a * b for a in left for b in right]
+    return min(products), max(products)
+
+
+def evaluate_tree(root, table):
+    """
+    computes every Func or Expr attribute of a part tree for every row of
+    table. Returns (results, evaluator), where results is a list of (part,
+    attribute name, Func, values) in tree order.
+    """
+    evaluator = Evaluator(table)
+    results = [(part, name, func, evaluator.evaluate(func)) for part, name, func in GP.func_attributes(root)]
+    return results, evaluator
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report computed part values across many saved settings")
+    parser.add_argument("template", help="template module, e.g. templates/marlin.py")
+    parser.add_argument("settings", nargs="+", help="saved settings JSON files, or one .jsonl corpus")
+    parser.add_argument("-e", "--expr", action="append", default=[],
+                        help='an extra expression to report, e.g. "X_MAX_POS - X_MIN_POS"')
+    parser.add_argument("--top", type=int, default=5, help="most common values to list per attribute")
+    args = parser.parse_args()
+
+    module = export.load_module(args.template)
+    if len(args.settings) == 1 and args.settings[0].endswith(".jsonl"):
+        import corpus
+        jsonl = corpus.JsonlCorpus(args.settings[0])
+        documents = jsonl.slice(0, len(jsonl))
+    else:
+        documents = ((path, json.load(open(path, "r"))) for path in args.settings)
+    stdout = sys.stdout
+    sys.stdout = _NullWriter() #VariableStore logs every write
+    try:
+        table = SettingsTable.from_documents(module, documents)
+        store = export.load_settings(module, {})
+        root = export.load_gui(module, store)
+    finally:
+        sys.stdout = stdout
+
+    results, evaluator = evaluate_tree(root, table)
+    rows = [(search.describe(part), name, func, values) for part, name, func, values in results]
+    rows.extend(("expression", expr, None, evaluator.evaluate(GP.Expr(expr))) for expr in args.expr)
+    print("%i documents, %i values computed on whole columns, %i row by row, %i rows failed%s"
+          % (table.rows, evaluator.vectorised, evaluator.per_row, evaluator.errors,
+             "" if numpy else " (numpy not installed)"))
+    for where, name, func, values in rows:
+        common = Counter(repr(value) for value in values).most_common(args.top)
+        print("%s: %s%s" % (where, name, " (%s)" % getattr(func, "source", func) if func else ""))
+        for value, count in common:
+            print("    %8i  %s" % (count, value))
@@ -0,0 +1,334 @@
+import os
+import ast
+import sys
+import imp
+import json
+import random
+import string
+import difflib
+import argparse
+from timeit import default_timer
+from templite import Templite
+
+import vstore
+import gui_parts as GP
+import export
+import derived
+import importer
+import precompile
+import search
+import lineprofile
+from benchmark import _NullWriter
+
+template_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates", "marlin.py")
+
+#Expressions derived.py must evaluate like Attribute.value, including over list items not every document has
+derived_expressions = ["TEMP_SENSOR[2] + 1", "HEATER_MAXTEMP[1] - HEATER_MINTEMP[1]", "X_MAX_POS - X_MIN_POS",
+                       "EXTRUDERS > 1", "1 if X_HOME_DIR else -1", "100 / (EXTRUDERS - 1)"]
+
+#Characters random text settings are made of, including ones that need escaping in C
+text_characters = string.ascii_letters + string.digits + " _-.:/\"\\'"
+
+
+class Field(object):
+    """
+    one setting the part tree lets the user edit, with the values its part
+    accepts. Indexed fields are the columns of a RepeatedGroup.
+    """
+    def __init__(self, key, kind, indexed=False, low=None, high=None, options=None):
+        self.key = key
+        self.kind = kind
+        self.indexed = indexed
+        self.low = low
+        self.high = high
+        self.options = options
+
+    def random(self, rng):
+        if self.kind is bool:
+            return rng.random() < 0.5
+        if self.kind is int:
+            return rng.randint(self.low, self.high)
+        if self.kind is float:
+            return round(rng.uniform(self.low, self.high), rng.choice((0, 1, 2, 4, 8)))
+        if self.options is not None:
+            return rng.choice(self.options)
+        return "".join(rng.choice(text_characters) for i in range(rng.randint(0, 12)))
+
+
+def fields(root):
+    """
+    returns a Field for every input of a part tree, reading each part's
+    range and options as they are for the store the tree was built with.
+    """
+    found = []
+    for part in search.walk(root):
+        if isinstance(part, GP.RepeatedGroup) or not hasattr(part, "name"):
+            continue
+        key = part.name.value
+        if not isinstance(key, basestring):
+            key = key[0]
+        indexed = isinstance(part.parent, GP.RepeatedGroup)
+        if isinstance(part, GP.IntegerInput):
+            found.append(Field(key, int, indexed, part.min.value, part.max.value))
+        elif isinstance(part, GP.RealInput):
+            found.append(Field(key, float, indexed, part.min.value, part.max.value))
+        elif isinstance(part, GP.ChoiceInput):
+            found.append(Field(key, None, indexed, options=[id for id, text in part.options.value]))
+        elif isinstance(part, GP.CheckInput):
+            found.append(Field(key, bool, indexed))
+        elif isinstance(part, GP.TextInput):
+            found.append(Field(key, None, indexed))
+    return found
+
+
+def random_settings(module, fields, rng, base=None):
+    """
+    returns a settings dictionary with a random value for every field, on
+    top of base. Scalars are set first, so columns are filled at the length
+    their count (e.g. EXTRUDERS) gives them.
+    """
+    store = export.load_settings(module, base or {})
+    for field in fields:
+        if not field.indexed:
+            store[field.key] = field.random(rng)
+    for field in fields:
+        if field.indexed:
+            store[field.key] = [field.random(rng) for i in range(len(store[field.key]))]
+    return json.loads(json.dumps(store, default=vstore.to_json))
+
+
+def batch(module, count, vary, seed):
+    """
+    returns count settings dictionaries that share one random base and each
+    randomise the same random fraction vary of the fields, like a product
+    line. Specialised templates fold the fields that are not varied.
+    """
+    rng = random.Random(seed)
+    root = export.load_gui(module, export.load_settings(module, {}))
+    all_fields = fields(root)
+    varied = rng.sample(all_fields, int(round(len(all_fields) * vary)))
+    base = random_settings(module, all_fields, rng)
+    return [random_settings(module, varied, rng, base) for i in range(count)]
+
+
+def precompiled(output, contents):
+    #The precompile.py module for one output, built in memory
+    module = imp.new_module("_equivalence_compiled")
+    exec(compile(precompile.generate(template_path, output, contents), "<precompiled %s>" % output, "exec"),
+         module.__dict__)
+    return precompile.CompiledTemplate(module)
+
+
+def engines(output, contents, stores):
+    """
+    returns (name, template) pairs for the reference engine followed by every
+    optimised engine, all rendering contents.
+    """
+    fixed = export.fixed_settings(stores)
+    varying = set().union(*stores) - set(fixed)
+    fixed.update(export.helpers)
+    return [("templite", Templite(contents)),
+            ("precompiled", precompiled(output, contents)),
+            ("specialised", Templite(contents).specialise(fixed, varying)),
+            ("specialised (nothing fixed)", Templite(contents).specialise(export.helpers, set().union(*stores)))]
+
+
+def compare(module, settings, repeat=3):
+    """
+    renders every output with every engine for each settings dictionary.
+    Returns a list of (output, engine, renders per second, mismatches) where
+    mismatches lists (settings index, diff) for results that differ from the
+    reference engine by a single byte.
+    """
+    stores = [export.load_settings(module, document) for document in settings]
+    results = []
+    for output, contents in sorted(export.load_outputs(module).items()):
+        expected = None
+        for name, template in engines(output, contents, stores):
+            rendered = [template.render(store, **export.helpers) for store in stores]
+            best = None
+            for i in range(repeat):
+                start = default_timer()
+                for store in stores:
+                    template.render(store, **export.helpers)
+                elapsed = default_timer() - start
+                best = elapsed if best is None else min(best, elapsed)
+            if expected is None:
+                expected = rendered
+            mismatches = []
+            for index, (a, b) in enumerate(zip(expected, rendered)):
+                if a != b:
+                    diff = difflib.unified_diff(a.splitlines(), b.splitlines(), "templite", name, lineterm="")
+                    mismatches.append((index, "\n".join(list(diff)[:12])))
+            results.append((output, name, len(stores) / best if best else 0.0, mismatches))
+    return results
+
+
+def save(directory, name, document):
+    #Keeps settings that rendered differently for a closer look
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(os.path.join(directory, name), "w") as fp:
+        json.dump(document, fp, indent=1, sort_keys=True)
+
+
+def flip_booleans(document):
+    #A copy of a settings dictionary with every boolean, including list items, negated
+    flip = lambda value: not value if isinstance(value, bool) else value
+    return dict((key, [flip(item) for item in value] if isinstance(value, list) else flip(value))
+                for key, value in document.items())
+
+
+def roundtrip(module, settings):
+    """
+    renders every output for each settings dictionary and for a copy with
+    every boolean flipped, reads the settings back out of the text with
+    importer.Importer and renders them again. Returns a list of (output,
+    settings index, settings, diff) for renders that came back different.
+    """
+    failures = []
+    for output, contents in sorted(export.load_outputs(module).items()):
+        template = Templite(contents)
+        reader = importer.Importer(module, output)
+        for index, document in enumerate(settings):
+            for variant in (document, flip_booleans(document)):
+                text = template.render(export.load_settings(module, variant), **export.helpers)
+                found, unmatched = reader.parse(text)
+                again = template.render(export.load_settings(module, found), **export.helpers)
+                if again != text:
+                    diff = difflib.unified_diff(text.splitlines(), again.splitlines(), "exported", "imported",
+                                                lineterm="")
+                    failures.append((output, index, variant, "\n".join(list(diff)[:12])))
+    return failures
+
+
+def check_derived(module, settings, expressions=derived_expressions):
+    """
+    evaluates every Func and Expr of the part tree, plus expressions, with
+    derived.Evaluator over a table of settings and compares each row with
+    Attribute.value for that document's store. Rows where the store raises
+    must hold a derived.Error. Returns a list of (expression, settings
+    index, expected, got) for rows that differ.
+    """
+    table = derived.SettingsTable.from_documents(module, enumerate(settings))
+    evaluator = derived.Evaluator(table)
+    root = export.load_gui(module, export.load_settings(module, {}))
+    funcs = [func for part, name, func in GP.func_attributes(root)] + [GP.Expr(expr) for expr in expressions]
+    stores = [export.load_settings(module, document) for document in settings]
+    failures = []
+    for func in funcs:
+        for index, value in enumerate(evaluator.evaluate(func)):
+            try:
+                expected = GP.Attribute(func, stores[index]).value
+            except Exception as error:
+                expected = derived.Error(error)
+            if expected != value or type(expected) is not type(value):
+                failures.append((getattr(func, "source", func), index, expected, value))
+    return failures
+
+
+def plain_lines(template):
+    """
+    returns the template lines that start a top-level statement and are
+    not part of a ${for}$, ${if}$ or other block, so run once per render.
+    """
+    body = ast.parse(template.source).body
+    starts = set()
+    blocked = set()
+    for index, node in enumerate(body):
+        if hasattr(node, "body"):
+            last = body[index + 1].lineno - 1 if index + 1 < len(body) else len(template.line_map) - 1
+            blocked.update(template.line_map[line] for line in range(node.lineno, last + 1))
+        else:
+            starts.add(template.line_map[node.lineno])
+    return starts - blocked
+
+
+def check_line_hits(module, settings):
+    """
+    profiles every output over the settings with lineprofile.LineProfiler
+    and checks that each plain template line got one hit per render.
+    Returns a list of (output, line, renders, hits) for lines that did not.
+    """
+    stores = [export.load_settings(module, document) for document in settings]
+    failures = []
+    for output, contents in sorted(export.load_outputs(module).items()):
+        profiler = lineprofile.LineProfiler(Templite(contents))
+        for store in stores:
+            profiler.render(store, **export.helpers)
+        for line in sorted(plain_lines(profiler.template)):
+            if profiler.hits.get(line, 0) != profiler.renders:
+                failures.append((output, line, profiler.renders, profiler.hits.get(line, 0)))
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that optimised template engines render byte-identical output")
+    parser.add_argument("template", nargs="?", default=template_path, help="template module")
+    parser.add_argument("-n", "--count", type=int, default=200, help="random settings per batch")
+    parser.add_argument("--batches", type=int, default=5, help="batches, each with its own shared base")
+    parser.add_argument("--vary", type=float, default=0.2, help="fraction of fields that differ within a batch")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first batch")
+    parser.add_argument("--repeat", type=int, default=3, help="timing repeats, the best is reported")
+    parser.add_argument("--save", metavar="DIRECTORY", help="write settings that render differently here")
+    parser.add_argument("--no-roundtrip", action="store_true",
+                        help="skip checking that importer.py reads every export back to the same settings")
+    args = parser.parse_args()
+    template_path = os.path.abspath(args.template)
+
+    module = export.load_module(template_path)
+    totals = {}
+    failed = 0
+    roundtrips = 0
+    derived_failures = 0
+    hit_failures = 0
+    for seed in range(args.seed, args.seed + args.batches):
+        stdout = sys.stdout
+        sys.stdout = _NullWriter() #VariableStore logs every write
+        try:
+            settings = batch(module, args.count, args.vary, seed)
+            results = compare(module, settings, args.repeat)
+            failures = [] if args.no_roundtrip else roundtrip(module, settings)
+            #Every field varies here, so list settings such as TEMP_SENSOR differ in length
+            mismatched = check_derived(module, batch(module, args.count, 1.0, seed))
+            miscounted = check_line_hits(module, settings[:10])
+        finally:
+            sys.stdout = stdout
+        for output, name, rate, mismatches in results:
+            total = totals.setdefault((output, name), [0.0, 0, len(totals)])
+            total[0] += rate / args.batches
+            total[1] += len(mismatches)
+            for index, diff in mismatches[:3]:
+                print("batch %i settings %i: %s differs from templite for %s\n%s"
+                      % (seed, index, name, output, diff))
+                if args.save:
+                    save(args.save, "batch%i-%i.json" % (seed, index), settings[index])
+            failed += len(mismatches)
+        for output, index, document, diff in failures[:3]:
+            print("batch %i settings %i: %s does not import back the same\n%s" % (seed, index, output, diff))
+            if args.save:
+                save(args.save, "batch%i-%i-import.json" % (seed, index), document)
+        roundtrips += len(failures)
+        failed += len(failures)
+        for expression, index, expected, got in mismatched[:3]:
+            print("batch %i settings %i: derived.py gives %r for %s, the store %r" % (seed, index, got, expression,
+                                                                                      expected))
+        derived_failures += len(mismatched)
+        failed += len(mismatched)
+        for output, line, renders, hits in miscounted[:3]:
+            print("batch %i: line %i of %s got %i hits in %i renders" % (seed, line, output, hits, renders))
+        hit_failures += len(miscounted)
+        failed += len(miscounted)
+
+    print("%i batches of %i random settings, %.0f%% of fields varied per batch"
+          % (args.batches, args.count, args.vary * 100))
+    print("%-20s %-28s %12s %8s %11s" % ("output", "engine", "renders/s", "speedup", "mismatches"))
+    reference = {}
+    for (output, name), (rate, mismatches, order) in sorted(totals.items(), key=lambda item: item[1][2]):
+        reference.setdefault(output, rate)
+        print("%-20s %-28s %12.0f %7.2fx %11i" % (output, name, rate, rate / reference[output], mismatches))
+    if not args.no_roundtrip:
+        print("importer round trip, booleans as generated and flipped: %i mismatches" % roundtrips)
+    print("derived values over settings with different list lengths: %i mismatches" % derived_failures)
+    print("lineprofile.py hits on template lines that run once per render: %i mismatches" % hit_failures)
+    sys.exit(1 if failed else 0)
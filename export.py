@@ -0,0 +1,332 @@
+import os
+import imp
+import stat
+import json
+import hashlib
+import inspect
+import tempfile
+import argparse
+from multiprocessing.pool import ThreadPool
+from templite import Templite, fragments, pure_functions
+
+import vstore
+import instrument
+import precompile
+import rendercache
+
+
+def load_module(path):
+    return imp.load_source(os.path.splitext(os.path.basename(path))[0], path)
+
+
+def _call_with_store(function, store):
+    #Template modules written before load_defaults/load_gui took a store see it through vstore.current()
+    args, varargs = inspect.getargspec(function)[:2]
+    if args or varargs:
+        return function(store)
+    with vstore.using(store):
+        return function()
+
+
+def load_defaults(module, store):
+    """
+    fills store with the module defaults, for modules with either the
+    load_defaults(store) or the older load_defaults() signature.
+    """
+    return _call_with_store(module.load_defaults, store)
+
+
+def load_gui(module, store):
+    """
+    builds the module's part tree over store, for modules with either the
+    load_gui(store) or the older load_gui() signature.
+    """
+    return _call_with_store(module.load_gui, store)
+
+
+def cbool(bool):
+    return str(bool).lower()
+
+
+def comment(bool):
+    return "" if bool else "//"
+
+
+helpers = {"cbool": cbool, "comment": comment}
+#The helpers only format their argument, so specialised templates may call them ahead of rendering
+pure_functions.update(helpers.values())
+
+
+def load_outputs(module):
+    """
+    returns module.load_outputs() after registering the template fragments
+    the module provides with load_fragments().
+    """
+    fragments.load(module)
+    return module.load_outputs()
+
+
+def compile_outputs(outputs, template_path=None, sandbox=False):
+    """
+    compiles every output template once so it can be rendered many times.
+    outputs - a dictionary of output name to template source
+    template_path - the template module; outputs built by precompile.py for
+                    it are imported instead of being compiled from source
+    sandbox - render with restricted builtins (precompiled modules are not used)
+    """
+    templates = {}
+    for name, contents in outputs.items():
+        if template_path and not sandbox:
+            with instrument.span("load precompiled", output=name):
+                templates[name] = precompile.load(template_path, name, contents)
+            if templates[name]:
+                continue
+        with instrument.span("Templite compile", output=name):
+            templates[name] = Templite(contents, sandbox=sandbox)
+    return templates
+
+
+def fixed_settings(stores):
+    """
+    returns a dictionary of the settings with the same value in every store.
+    """
+    first = stores[0]
+    return dict((key, value) for key, value in first.items()
+                if all(key in store and store[key] == value for store in stores[1:]))
+
+
+def specialise_outputs(outputs, stores, sandbox=False):
+    """
+    compiles every output template specialised for the given stores: the
+    settings they all share are rendered ahead of time, leaving only the
+    settings that vary to be rendered per store.
+    """
+    fixed = fixed_settings(stores)
+    varying = set().union(*stores) - set(fixed)
+    fixed.update(helpers)
+    templates = {}
+    for name, contents in outputs.items():
+        with instrument.span("Templite specialise", output=name, varying=len(varying)):
+            templates[name] = Templite(contents, sandbox=sandbox).specialise(fixed, varying)
+    return templates
+
+
+def render_outputs(templates, store, cache=None):
+    """
+    renders compiled output templates against a variable store.
+    Returns a dictionary of output name to rendered text.
+    cache - an optional rendercache.RenderCache to serve repeated inputs from
+    """
+    rendered = {}
+    for name, template in templates.items():
+        with instrument.span("Templite.render", output=name):
+            if cache is None:
+                rendered[name] = template.render(store, **helpers)
+            else:
+                rendered[name] = cache.render(template, store, **helpers)
+    return rendered
+
+
+def atomic_write(path, text, sync=False):
+    """
+    writes text to path through a temporary file in the same directory, so
+    readers only ever see the old or the new contents.
+    sync - fsync the new contents before they replace the old ones
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".")
+    try:
+        with os.fdopen(fd, "w") as fh:
+            fh.write(text)
+            if sync:
+                fh.flush()
+                os.fsync(fh.fileno())
+        #mkstemp creates private files; keep the mode a plain open() would give
+        try:
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+        except OSError:
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0666 & ~umask
+        os.chmod(temp_path, mode)
+        try:
+            os.rename(temp_path, path)
+        except OSError:
+            #Windows will not rename over an existing file
+            os.remove(path)
+            os.rename(temp_path, path)
+    except:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class Manifest(object):
+    """
+    records the content hash, size and modification time of every file
+    exported into a directory, so unchanged outputs are not rewritten.
+    Existing files of the right size are always hashed again, as a hand
+    edit can keep both their size and modification time.
+    """
+    filename = ".guiconfig-manifest.json"
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, self.filename)
+        self.written = 0
+        self.skipped = 0
+        self._changed = False
+        try:
+            with open(self.path, "r") as fp:
+                self.entries = json.load(fp)
+        except (IOError, ValueError):
+            self.entries = {}
+
+    def write(self, name, text):
+        """
+        writes text to name inside the directory unless the file already has
+        exactly this content. Returns True if the file was written.
+        """
+        path = os.path.join(self.directory, name)
+        digest = hashlib.sha1(text).hexdigest()
+        if self._current_hash(name, path, len(text)) == digest:
+            self.skipped += 1
+            return False
+        atomic_write(path, text)
+        self._record(name, path, digest)
+        self.written += 1
+        return True
+
+    def save(self):
+        if self._changed:
+            atomic_write(self.path, json.dumps(self.entries, indent=1, sort_keys=True))
+            self._changed = False
+
+    def _current_hash(self, name, path, size):
+        try:
+            info = os.stat(path)
+        except OSError:
+            return None
+        if info.st_size != size:
+            return None
+        #An edit within the filesystem's mtime granularity keeps size and mtime, so always hash what is on disk
+        with open(path, "r") as fh:
+            digest = hashlib.sha1(fh.read()).hexdigest()
+        self._record(name, path, digest)
+        return digest
+
+    def _record(self, name, path, digest):
+        info = os.stat(path)
+        entry = {"sha1": digest, "size": info.st_size, "mtime": info.st_mtime}
+        if self.entries.get(name) != entry:
+            self.entries[name] = entry
+            self._changed = True
+
+
+def load_settings(module, settings, store=None):
+    """
+    fills a new VariableStore (or store, after clearing it) with the module
+    defaults and applies settings on top.
+    """
+    if store is None:
+        store = vstore.VariableStore()
+    else:
+        store.clear()
+    with instrument.span("load_defaults"):
+        load_defaults(module, store)
+    with instrument.span("update"):
+        store.update(settings)
+    return store
+
+
+def export_store(module, settings):
+    #A settings dictionary or path loaded into its own VariableStore
+    if isinstance(settings, basestring):
+        with open(settings, "r") as fp:
+            settings = json.load(fp)
+    return load_settings(module, settings)
+
+
+def export_settings(module, templates, name, settings, directory, cache=None):
+    """
+    exports one document into directory/<name>/<output> using its own
+    VariableStore. Returns the Manifest that was written.
+    settings - a settings dictionary, the path of a saved settings file or
+               a VariableStore already filled by load_settings
+    """
+    store = settings if isinstance(settings, vstore.VariableStore) else export_store(module, settings)
+    target = os.path.join(directory, name)
+    if not os.path.isdir(target):
+        try:
+            os.makedirs(target)
+        except OSError:
+            #Another thread exporting a settings file of the same name
+            if not os.path.isdir(target):
+                raise
+    manifest = Manifest(target)
+    for output, text in render_outputs(templates, store, cache).items():
+        manifest.write(output, text)
+    manifest.save()
+    return manifest
+
+
+def export_documents(module, documents, directory, sandbox=False, cache=None, threads=1, specialise=False):
+    """
+    renders every output of module for each (name, settings) pair into
+    directory/<name>/<output>, where settings is a dictionary or a settings
+    file path. Files whose contents would not change are left alone.
+    Returns (written, skipped) file counts.
+    threads - number of documents exported concurrently
+    specialise - load every document first and render the settings they
+                 share only once (see specialise_outputs)
+    """
+    if specialise:
+        documents = [(name, export_store(module, settings)) for name, settings in documents]
+    if specialise and documents:
+        templates = specialise_outputs(load_outputs(module), [store for name, store in documents], sandbox)
+    else:
+        templates = compile_outputs(load_outputs(module), module.__file__, sandbox)
+    export = lambda document: export_settings(module, templates, document[0], document[1], directory, cache)
+    if threads > 1:
+        pool = ThreadPool(threads)
+        try:
+            manifests = pool.map(export, documents)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        manifests = map(export, documents)
+    return (sum(manifest.written for manifest in manifests),
+            sum(manifest.skipped for manifest in manifests))
+
+
+def export_batch(module, settings_paths, directory, sandbox=False, cache=None, threads=1, specialise=False):
+    """
+    renders every output of module for each settings file into
+    directory/<settings name>/<output>. See export_documents.
+    """
+    documents = [(os.path.splitext(os.path.basename(path))[0], path) for path in settings_paths]
+    return export_documents(module, documents, directory, sandbox, cache, threads, specialise)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render template outputs for many settings files")
+    parser.add_argument("template", help="template module, e.g. templates/marlin.py")
+    parser.add_argument("settings", nargs="+", help="saved settings JSON files")
+    parser.add_argument("-o", "--output", default=".", help="output directory")
+    parser.add_argument("--trace", help="write a Chrome trace JSON of the export to this file")
+    parser.add_argument("--sandbox", action="store_true",
+                        help="render template outputs with restricted builtins")
+    parser.add_argument("--cache", help="directory of a render cache shared between runs")
+    parser.add_argument("--cache-size", type=int, default=10000, help="maximum number of cached renders")
+    parser.add_argument("-j", "--threads", type=int, default=1, help="settings files to export at once")
+    parser.add_argument("--specialise", action="store_true",
+                        help="render the settings all files share only once")
+    args = parser.parse_args()
+    if args.trace:
+        instrument.enable(args.trace)
+    cache = rendercache.RenderCache(args.cache, args.cache_size) if args.cache else None
+    written, skipped = export_batch(load_module(args.template), args.settings, args.output,
+                                    args.sandbox, cache, args.threads, args.specialise)
+    print("exported %i files, %i unchanged" % (written, skipped))
+    if cache:
+        print("render cache: %i hits, %i misses, %i not cacheable" % (cache.hits, cache.misses, cache.uncached))
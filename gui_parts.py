@@ -1,9 +1,17 @@
 import wx
+import wx.grid
 import os
+import ast
+import operator
+import __builtin__
 
 import vstore
+import instrument
+from templite import free_names
     
 class Func(object):
+    __slots__ = ("vars", "fn")
+
     def __init__(self, vars, fn):
         self.vars = vars
         self.fn = fn
@@ -15,13 +23,152 @@ class Func(object):
         return self.fn(*[dict[x] for x in self.vars])
 
 
-class Attribute(object):
+def expression_names(source):
+    """
+    returns the store keys a Python expression reads, in order of first
+    use: every free name that is not a builtin.
+    """
+    tree = ast.parse(source.strip(), mode="eval")
+    loaded, stored = free_names(tree)
+    names = []
+    nodes = [node for node in ast.walk(tree) if isinstance(node, ast.Name)]
+    for node in sorted(nodes, key=lambda node: (node.lineno, node.col_offset)):
+        if node.id in loaded and node.id not in stored and node.id not in names \
+                and not hasattr(__builtin__, node.id):
+            names.append(node.id)
+    return names
+
+
+class Expr(Func):
+    """
+    a Func written as a Python expression over store keys, e.g.
+    Expr("EXTRUDERS - 1"). The keys it depends on are read from the
+    expression, which is compiled once into a function of their values.
+    """
+    __slots__ = ("source", "_call")
+
+    def __init__(self, source):
+        self.source = source
+        self.vars = expression_names(source)
+        self.fn = eval("lambda %s: (%s)" % (", ".join(self.vars), source.strip()), {})
+        fn = self.fn
+        if not self.vars:
+            self._call = lambda store: fn()
+        elif len(self.vars) == 1:
+            key = self.vars[0]
+            self._call = lambda store: fn(store[key])
+        else:
+            getter = operator.itemgetter(*self.vars)
+            self._call = lambda store: fn(*getter(store))
+
+    def __call__(self, dict):
+        return self._call(dict)
+
+    def __repr__(self):
+        return "Expr(%r)" % self.source
+
+
+class ExprBatch(object):
+    """
+    evaluates many expressions against a store in one call, reading each
+    store key once. evaluate returns the values in the order given.
+    """
+    def __init__(self, exprs):
+        self.exprs = [expr if isinstance(expr, Expr) else Expr(expr) for expr in exprs]
+        self.vars = []
+        for expr in self.exprs:
+            self.vars.extend(name for name in expr.vars if name not in self.vars)
+        source = "lambda %s: (%s,)" % (", ".join(self.vars), ", ".join("(%s)" % expr.source.strip()
+                                                                        for expr in self.exprs))
+        self.fn = eval(source, {})
+
+    def get_dependencies(self):
+        return self.vars
+
+    def evaluate(self, store):
+        return self.fn(*[store[key] for key in self.vars])
+
+
+def func_attributes(root):
+    """
+    yields (part, attribute name, Func) for every attribute computed by a
+    Func or Expr, for root and every part below it in tree order.
+    """
+    parts = [root]
+    while parts:
+        part = parts.pop()
+        parts.extend(reversed(part.children))
+        for cls in type(part).__mro__:
+            for name in getattr(cls, "__slots__", ()):
+                attribute = getattr(part, name, None)
+                if isinstance(attribute, Attribute) and isinstance(attribute._var, Func):
+                    yield part, name, attribute._var
+
+
+def dependency_graph(root):
+    """
+    returns a dictionary of store key to the (part, attribute name) pairs
+    whose Func or Expr reads that key, for every part below root.
+    """
+    graph = {}
+    for part, name, func in func_attributes(root):
+        for key in func.get_dependencies():
+            graph.setdefault(key, []).append((part, name))
+    return graph
+
+
+_constants = {}
+_option_tables = {}
+
+
+class Constant(object):
+    """
+    an attribute whose value never changes. Attribute returns one shared
+    Constant per distinct hashable value, so it keeps no handler list.
+    """
+    __slots__ = ("_var",)
+
     def __init__(self, value):
         self._var = value
+
+    def add_handler(self, handler, call=False):
+        #The value never changes, so the handler can only be called now
+        if call:
+            handler(self._var)
+
+    @property
+    def value(self):
+        return self._var
+
+
+def intern_options(options):
+    #Identical option tables share one tuple of (id, text) tuples
+    table = tuple(tuple(option) for option in options)
+    return _option_tables.setdefault(table, table)
+
+
+class Attribute(object):
+    __slots__ = ("_var", "handlers", "store", "__weakref__")
+
+    def __new__(cls, value, store=None):
+        if cls is Attribute and not callable(value):
+            try:
+                key = (type(value), value)
+                return _constants[key]
+            except KeyError:
+                constant = _constants[key] = Constant(value)
+                return constant
+            except TypeError:
+                pass #Unhashable values get their own Attribute
+        return object.__new__(cls)
+
+    def __init__(self, value, store=None):
+        self._var = value
         self.handlers = []
+        self.store = vstore.current() if store is None else store
         try:
             for dep in self._var.get_dependencies():
-                vstore.instance.add_binding(dep, self._change_handler)
+                self.store.add_binding(dep, self._change_handler, weak=True)
         except AttributeError:
             pass
             
@@ -31,21 +178,105 @@ class Attribute(object):
             handler(self.value)
 
     def _change_handler(self, key, value):
+        if instrument.enabled:
+            instrument.count("attribute recomputes", key, len(self.handlers))
         for handler in self.handlers:
             handler(self.value)
 
     @property
     def value(self):
         try:
-            return self._var(vstore.instance)
+            return self._var(self.store)
         except TypeError:
             return self._var
 
 
+_pending_layouts = set()
+
+
+def schedule_layout(part):
+    #Queue part for the next flush_layouts, which runs once the event loop is idle
+    if not _pending_layouts:
+        wx.CallAfter(flush_layouts)
+    _pending_layouts.add(part)
+
+
+def flush_layouts():
+    """
+    lays out every container that requested it since the last flush, once
+    each, skipping those inside another pending container. Windows are frozen
+    while this happens so they only repaint once.
+    """
+    pending = set(_pending_layouts)
+    _pending_layouts.clear()
+    outermost = []
+    for part in pending:
+        ancestor = part.parent
+        while ancestor and ancestor not in pending:
+            ancestor = ancestor.parent
+        if ancestor is None:
+            outermost.append(part)
+    if instrument.enabled:
+        instrument.count("layouts", "requested", len(pending))
+        instrument.count("layouts", "performed", len(outermost))
+    frozen = set(part._control.GetTopLevelParent() for part in outermost)
+    for window in frozen:
+        window.Freeze()
+    try:
+        for part in outermost:
+            part.layout()
+    finally:
+        for window in frozen:
+            window.Thaw()
+
+
+def store_key(name):
+    #The top level store key of a name, which may be a path such as ["TEMP_SENSOR", 0]
+    return name if isinstance(name, basestring) else name[0]
+
+
+class KeyIndex(object):
+    """
+    maps top level store keys to the parts whose widgets display them, so
+    only the parts showing changed keys need refreshing.
+    """
+    def __init__(self):
+        self.parts = {}
+
+    def add(self, key, part):
+        self.parts.setdefault(key, []).append(part)
+
+    def remove(self, key, part):
+        try:
+            self.parts[key].remove(part)
+        except (KeyError, ValueError):
+            pass
+
+    def refresh(self, keys):
+        """
+        refreshes every part displaying one of keys, once each, and returns
+        how many parts were refreshed.
+        """
+        refreshed = set()
+        for key in keys:
+            for part in self.parts.get(key, ()):
+                if id(part) not in refreshed:
+                    refreshed.add(id(part))
+                    part.refresh()
+            if instrument.enabled:
+                instrument.count("targeted refreshes", key, len(self.parts.get(key, ())))
+        return len(refreshed)
+
+
 class GenericPart(object):
+    __slots__ = ("children", "parent", "store", "_key_index", "_indexed_key", "_control", "_sizer", "_input",
+                 "__weakref__")
+
     def __init__(self):
         self.children = []
         self.parent = None
+        self.store = vstore.current()
+        self._key_index = None
 
     def add_children(self, *args):
         for child in args:
@@ -64,13 +295,82 @@ class GenericPart(object):
         if recursive:
             for child in self.children:
                 child.refresh()
+
+    def refresh_keys(self, keys):
+        """
+        refreshes only the widgets displaying the given store keys, e.g. the
+        keys returned by VariableStore.update. Returns the number refreshed.
+        """
+        return self.key_index().refresh(keys)
+
+    def key_index(self):
+        #The index is shared by the whole tree and kept on its root
+        root = self
+        while root.parent:
+            root = root.parent
+        if root._key_index is None:
+            root._key_index = KeyIndex()
+        return root._key_index
+
+    def bind_name(self):
+        #Refresh from the store whenever name changes, keeping the key index in step
+        self._indexed_key = None
+        self.name.add_handler(self._name_changed, True)
+
+    def _name_changed(self, name):
+        index = self.key_index()
+        if self._indexed_key is not None:
+            index.remove(self._indexed_key, self)
+        self._indexed_key = store_key(name)
+        index.add(self._indexed_key, self)
+        self.refresh(name)
                 
     def layout(self):
         if self.parent:
             self.parent.layout()
 
+    def request_layout(self):
+        #Like layout, but coalesced with other requests until the event loop is idle
+        if self.parent:
+            self.parent.request_layout()
+
+    def reveal(self):
+        """
+        shows this part by selecting it in every container above it, then
+        gives it the keyboard focus.
+        """
+        path = []
+        part = self
+        while part.parent:
+            path.append(part)
+            part = part.parent
+        for child in reversed(path):
+            child.parent.show_child(child)
+        self.focus()
+
+    def show_child(self, child):
+        pass
+
+    def focus(self):
+        try:
+            self._input.SetFocus()
+        except AttributeError:
+            pass
+
+    #Cell handling used when this part describes a column of a RepeatedGroup
+    def grid_attr(self):
+        return wx.grid.GridCellAttr()
+
+    def grid_value(self, value):
+        return str(value)
+
+    def grid_parse(self, text):
+        return text
+
 
 class Notebook(GenericPart):
+    __slots__ = ()
+
     def __init__(self):
         GenericPart.__init__(self)
 
@@ -85,6 +385,12 @@ class Notebook(GenericPart):
             page_count += 1
 
         return self._control
+
+    def show_child(self, child):
+        self._control.SetSelection(self.children.index(child))
+
+    def request_layout(self):
+        schedule_layout(self)
         
     def layout(self):
         self._control.Layout()
@@ -93,6 +399,8 @@ class Notebook(GenericPart):
             
 
 class Tab(GenericPart):
+    __slots__ = ("title", "_treectrl", "_imagelist", "_icons", "_iconcount", "_items")
+
     def __init__(self, title):
         GenericPart.__init__(self)
         self.title = Attribute(title)
@@ -114,6 +422,7 @@ class Tab(GenericPart):
         self._treectrl.AddRoot("root")
         self._treectrl.SetIndent(0)
         self._control.Bind(wx.EVT_TREE_SEL_CHANGED, self.on_sel_changed, self._treectrl)
+        self._items = []
 
         #Load child controls
         for child in self.children:
@@ -134,6 +443,7 @@ class Tab(GenericPart):
             root = self._treectrl.GetRootItem()
             treeData = wx.TreeItemData(control)
             item = self._treectrl.AppendItem(root, child.title.value, iconIndex, iconIndex, treeData)
+            self._items.append(item)
             child.title.add_handler(lambda val: self._treectrl.SetItemText(item, val))
         return self._control
 
@@ -148,6 +458,12 @@ class Tab(GenericPart):
                 control.Hide()
             (child, cookie) = self._treectrl.GetNextChild(root, cookie)
         self.layout()
+
+    def show_child(self, child):
+        self._treectrl.SelectItem(self._items[self.children.index(child)])
+
+    def request_layout(self):
+        schedule_layout(self)
         
     def layout(self):
         self._control.Layout()
@@ -156,6 +472,8 @@ class Tab(GenericPart):
 
             
 class Page(GenericPart):
+    __slots__ = ("title", "icon", "_vsizer")
+
     def __init__(self, title, icon="cog.png"):
         GenericPart.__init__(self)
         self.title = Attribute(title)
@@ -176,11 +494,16 @@ class Page(GenericPart):
     def refresh(self):
         GenericPart.refresh(self)
 
+    def request_layout(self):
+        schedule_layout(self)
+
     def layout(self):
         self._control.Layout()
   
   
 class OptionsGroup(GenericPart):
+    __slots__ = ("title", "visible")
+
     def __init__(self, title, visible=True):
         GenericPart.__init__(self)
         self.title = Attribute(title)
@@ -202,10 +525,120 @@ class OptionsGroup(GenericPart):
     
     def _show(self, val):
         self._control.Show(val)
-        self.layout()
+        self.request_layout()
+
+
+class RepeatedGroup(GenericPart):
+    """
+    Edits an indexed collection (e.g. a vstore.IndexedGroup) as a table with
+    one row per index. Children are input parts whose names are the column
+    keys; they describe the columns and are never built as widgets. The grid
+    is virtual, so cells are only read when visible and each column shares a
+    single editor across all rows.
+    """
+    __slots__ = ("title", "count", "row_title", "_grid", "_table")
+
+    def __init__(self, title, count, row_title="%i"):
+        GenericPart.__init__(self)
+        self.title = Attribute(title)
+        self.count = Attribute(Expr(count))
+        self.row_title = Attribute(row_title)
+
+    def build_gui(self, parent_ctrl):
+        self._control = wx.StaticBox(parent_ctrl, label=self.title.value)
+        self._sizer = wx.StaticBoxSizer(self._control, wx.VERTICAL)
+        self._grid = wx.grid.Grid(self._control, size=(-1, 150))
+        self._table = _RepeatedGroupTable(self)
+        self._grid.SetTable(self._table, True)
+        for col, child in enumerate(self.children):
+            self._grid.SetColAttr(col, child.grid_attr())
+        self._grid.SetRowLabelSize(wx.grid.GRID_AUTOSIZE)
+        self._grid.AutoSizeColumns(False)
+        self._sizer.Add(self._grid, 1, wx.EXPAND | wx.ALL, 0)
+
+        #Attribute change handlers
+        self.title.add_handler(self._control.SetLabel)
+        self.count.add_handler(self._set_rows, True)
+        index = self.key_index()
+        for child in self.children:
+            try:
+                index.add(store_key(child.name.value), self)
+                self.store[child.name.value].add_binding(None, self._cell_changed, weak=True)
+            except (KeyError, AttributeError):
+                pass
+        return self._sizer
+
+    def _set_rows(self, count):
+        change = count - self._table.rows
+        self._table.rows = count
+        if change > 0:
+            msg = wx.grid.GridTableMessage(self._table, wx.grid.GRIDTABLE_NOTIFY_ROWS_APPENDED, change)
+        elif change < 0:
+            msg = wx.grid.GridTableMessage(self._table, wx.grid.GRIDTABLE_NOTIFY_ROWS_DELETED,
+                                           count, -change)
+        else:
+            return
+        self._grid.ProcessTableMessage(msg)
+        self.request_layout()
+
+    def _cell_changed(self, index, value):
+        if index < self._table.rows:
+            self._grid.Refresh()
+
+    def refresh(self, recursive=True):
+        #Children only describe columns so there is nothing to recurse into
+        self._grid.ForceRefresh()
+
+    def show_child(self, child):
+        col = self.children.index(child)
+        row = max(self._grid.GetGridCursorRow(), 0)
+        if row < self._table.rows:
+            self._grid.SetGridCursor(row, col)
+            self._grid.MakeCellVisible(row, col)
+        self._grid.SetFocus()
+
+
+class _RepeatedGroupTable(wx.grid.PyGridTableBase):
+    def __init__(self, group):
+        wx.grid.PyGridTableBase.__init__(self)
+        self.group = group
+        self.rows = 0
+
+    def GetNumberRows(self):
+        return self.rows
+
+    def GetNumberCols(self):
+        return len(self.group.children)
+
+    def IsEmptyCell(self, row, col):
+        return False
+
+    def GetValue(self, row, col):
+        child = self.group.children[col]
+        try:
+            return child.grid_value(self.group.store.getr((child.name.value, row)))
+        except (KeyError, IndexError):
+            return ""
+
+    def SetValue(self, row, col, value):
+        child = self.group.children[col]
+        try:
+            self.group.store.setr((child.name.value, row), child.grid_parse(value))
+        except ValueError:
+            pass
+
+    def GetColLabelValue(self, col):
+        child = self.group.children[col]
+        label = child.label.value
+        return "%s (%s)" % (child.title.value, label) if label else child.title.value
+
+    def GetRowLabelValue(self, row):
+        return self.group.row_title.value % row
 
 
 class TextInput(GenericPart):
+    __slots__ = ("title", "name", "label", "tooltip", "_title", "_label")
+
     def __init__(self, title, name, label="", tooltip=None):
         GenericPart.__init__(self)
         self.title = Attribute(title)
@@ -224,7 +657,7 @@ class TextInput(GenericPart):
 
         #Attribute change handlers
         self.title.add_handler(self._title.SetLabel)
-        self.name.add_handler(self.refresh, True)
+        self.bind_name()
         self.tooltip.add_handler(lambda val:
                                  self._input.SetToolTip(wx.ToolTip(val) if val else None), True)
 
@@ -232,17 +665,19 @@ class TextInput(GenericPart):
         return self._sizer
 
     def on_value_changed(self, event):
-        vstore.instance.setr(self.name.value, self._input.GetValue())
+        self.store.setr(self.name.value, self._input.GetValue())
 
     def refresh(self, val=None):
         try:
             if val is None: val = self.name.value
-            self._input.ChangeValue(vstore.instance.getr(val))
+            self._input.ChangeValue(self.store.getr(val))
         except KeyError:
             pass
 
 
 class IntegerInput(GenericPart):
+    __slots__ = ("title", "min", "max", "name", "label", "tooltip", "_title", "_label")
+
     def __init__(self, title, name, label="", min=0, max=100, tooltip=None):
         GenericPart.__init__(self)
         self.title = Attribute(title)
@@ -268,7 +703,7 @@ class IntegerInput(GenericPart):
         self.title.add_handler(self._title.SetLabel)
         self.min.add_handler(self._min_change_handler)
         self.max.add_handler(self._max_change_handler)
-        self.name.add_handler(self.refresh, True)
+        self.bind_name()
         self.tooltip.add_handler(lambda val:
                                  self._input.SetToolTip(wx.ToolTip(val) if val else None), True)
 
@@ -279,22 +714,33 @@ class IntegerInput(GenericPart):
         self._input.SetRange(self._input.Min, val)
         self.on_value_changed(None)
 
+    def grid_attr(self):
+        attr = wx.grid.GridCellAttr()
+        attr.SetEditor(wx.grid.GridCellNumberEditor(self.min.value, self.max.value))
+        attr.SetRenderer(wx.grid.GridCellNumberRenderer())
+        return attr
+
+    def grid_parse(self, text):
+        return min(max(int(text), int(self.min.value)), int(self.max.value))
+
     def _min_change_handler(self, val):
         self._input.SetRange(val, self._input.Max)
         self.on_value_changed(None)
 
     def on_value_changed(self, event):
-        vstore.instance.setr(self.name.value, self._input.GetValue())
+        self.store.setr(self.name.value, self._input.GetValue())
 
     def refresh(self, val=None):
         try:
             if val is None: val = self.name.value
-            self._input.SetValue(vstore.instance.getr(val))
+            self._input.SetValue(self.store.getr(val))
         except KeyError:
             pass
 
 
 class RealInput(GenericPart):
+    __slots__ = ("title", "min", "max", "name", "label", "tooltip", "_title", "_label")
+
     def __init__(self, title, name, label="", min=0.0, max=100.0, tooltip=None):
         GenericPart.__init__(self)
         self.title = Attribute(title)
@@ -320,7 +766,7 @@ class RealInput(GenericPart):
         self.title.add_handler(self._title.SetLabel)
         self.min.add_handler(self._min_change_handler)
         self.max.add_handler(self._max_change_handler)
-        self.name.add_handler(self.refresh, True)
+        self.bind_name()
         self.tooltip.add_handler(lambda val:
                                  self._input.SetToolTip(wx.ToolTip(val) if val else None), True)
 
@@ -332,28 +778,42 @@ class RealInput(GenericPart):
         self._input.SetRange(self._input.Min, float(val))
         self.on_value_changed(None)
 
+    def grid_attr(self):
+        attr = wx.grid.GridCellAttr()
+        attr.SetEditor(wx.grid.GridCellFloatEditor(-1, 2))
+        attr.SetRenderer(wx.grid.GridCellFloatRenderer(-1, 2))
+        return attr
+
+    def grid_value(self, value):
+        return repr(float(value))
+
+    def grid_parse(self, text):
+        return min(max(float(text), float(self.min.value)), float(self.max.value))
+
     def _min_change_handler(self, val):
         self._input.SetRange(float(val), self._input.Max)
         self.on_value_changed(None)
 
     def on_value_changed(self, event):
-        vstore.instance.setr(self.name.value, self._input.GetValue())
+        self.store.setr(self.name.value, self._input.GetValue())
 
     def refresh(self, val=None):
         try:
             if val is None: val = self.name.value
-            self._input.SetValue(vstore.instance.getr(val))
+            self._input.SetValue(self.store.getr(val))
         except KeyError:
             pass
 
 
 class ChoiceInput(GenericPart):
+    __slots__ = ("title", "name", "label", "options", "tooltip", "_title", "_label", "_optionids")
+
     def __init__(self, title, name, label="", options=[], tooltip=None):
         GenericPart.__init__(self)
         self.title = Attribute(title)
         self.name = Attribute(name)
         self.label = Attribute(label)
-        self.options = Attribute(options)
+        self.options = Attribute(options if isinstance(options, Func) else intern_options(options))
         self.tooltip = Attribute(tooltip)        
 
     def build_gui(self, parent_ctrl):
@@ -369,7 +829,7 @@ class ChoiceInput(GenericPart):
         #Attribute change handlers
         self.title.add_handler(self._title.SetLabel)
         self.options.add_handler(self._set_options, True) #This needs to be first to initialize the optionids
-        self.name.add_handler(self.refresh, True)
+        self.bind_name()
         self.tooltip.add_handler(lambda val:
                                  self._input.SetToolTip(wx.ToolTip(val) if val else None), True)
 
@@ -381,18 +841,37 @@ class ChoiceInput(GenericPart):
         self._optionids = [obj[0] for obj in options]
         self._input.InsertItems([obj[1] for obj in options], pos=0)
 
+    def grid_attr(self):
+        attr = wx.grid.GridCellAttr()
+        attr.SetEditor(wx.grid.GridCellChoiceEditor([obj[1] for obj in self.options.value]))
+        return attr
+
+    def grid_value(self, value):
+        for id, text in self.options.value:
+            if id == value:
+                return text
+        return str(value)
+
+    def grid_parse(self, text):
+        for id, option in self.options.value:
+            if option == text:
+                return id
+        raise ValueError("unknown option %r" % text)
+
     def on_value_changed(self, event):
-        vstore.instance.setr(self.name.value, self._optionids[self._input.GetSelection()])
+        self.store.setr(self.name.value, self._optionids[self._input.GetSelection()])
 
     def refresh(self, val=None):
         try:
             if val is None: val = self.name.value
-            self._input.SetSelection(self._optionids.index(vstore.instance.getr(val)))
+            self._input.SetSelection(self._optionids.index(self.store.getr(val)))
         except KeyError:
             pass
             
 
 class CheckInput(GenericPart):
+    __slots__ = ("title", "name", "label", "tooltip", "_title")
+
     def __init__(self, title, name, label="", tooltip=None):
         GenericPart.__init__(self)
         self.title = Attribute(title)
@@ -409,7 +888,7 @@ class CheckInput(GenericPart):
 
         #Attribute change handlers
         self.title.add_handler(self._title.SetLabel)
-        self.name.add_handler(self.refresh, True)
+        self.bind_name()
         self.tooltip.add_handler(lambda val:
                                  self._input.SetToolTip(wx.ToolTip(val) if val else None), True)
 
@@ -417,11 +896,23 @@ class CheckInput(GenericPart):
         return self._sizer
 
     def on_value_changed(self, event):
-        vstore.instance.setr(self.name.value, self._input.GetValue())
+        self.store.setr(self.name.value, self._input.GetValue())
 
     def refresh(self, val=None):
         try:
             if val is None: val = self.name.value
-            self._input.SetValue(vstore.instance.getr(val))
+            self._input.SetValue(self.store.getr(val))
         except KeyError:
             pass
+
+    def grid_attr(self):
+        attr = wx.grid.GridCellAttr()
+        attr.SetEditor(wx.grid.GridCellBoolEditor())
+        attr.SetRenderer(wx.grid.GridCellBoolRenderer())
+        return attr
+
+    def grid_value(self, value):
+        return "1" if value else ""
+
+    def grid_parse(self, text):
+        return text not in ("", "0")
@@ -0,0 +1,355 @@
+import os
+import re
+import json
+import time
+import fnmatch
+import argparse
+import multiprocessing
+
+import vstore
+from export import load_module, load_settings, load_outputs
+from templite import fragments
+
+#Literal parts of a template line that can vary in hand-edited files
+_whitespace = re.compile(r"(\s+)")
+
+_name = r"[A-Za-z_]\w*"
+_target = re.compile(r"^(%s)(?:\[(%s)\])?(?:\s*==\s*(.+))?$" % (_name, _name))
+_emit = re.compile(r"^emit\((.*)\)$", re.DOTALL)
+_call = re.compile(r"^(comment|cbool|int)\((.*)\)$", re.DOTALL)
+_choice = re.compile(r"^(\S+) if (.+) else (\S+)$")
+_loop = re.compile(r"^for (%s) in " % _name)
+_list = re.compile(r"^for (%s) in range\(%s\):\s*emit\((['\"])(.*?)\2 %% (%s)\[\1\]\)$" % (_name, _name, _name))
+_format = re.compile(r"%[-+ #0]*\d*(?:\.\d+)?([dif])")
+_format_patterns = {"d": r"-?\d+", "i": r"-?\d+", "f": r"-?[\d.]+(?:e[-+]?\d+)?"}
+
+
+def literal(text):
+    #A value as written in a C header: integers, floats or raw text
+    text = text.strip()
+    for kind in (int, float):
+        try:
+            return kind(text)
+        except ValueError:
+            pass
+    return text
+
+
+class LinePattern(object):
+    """
+    a regular expression for one line of a template output. Each capture
+    group has a decoder that turns the captured text into store values.
+    """
+    def __init__(self, regex, decoders, anchor):
+        self.regex = re.compile(regex)
+        self.decoders = decoders
+        self.anchor = anchor
+
+    def match(self, line):
+        if self.anchor not in line:
+            return None
+        match = self.regex.match(line)
+        if match is None:
+            return None
+        index = None
+        values = []
+        for decoder, text in zip(self.decoders, match.groups()):
+            if decoder[0] == "index":
+                index = int(text)
+            else:
+                values.append((decoder, text))
+        found = []
+        for decoder, text in values:
+            found.extend(decode(decoder, text, index))
+        return found
+
+
+def decode(decoder, text, index):
+    """
+    returns a list of (path, value) pairs for the text captured by decoder,
+    where path is a store key or a (key, index) pair.
+    """
+    kind, (name, indexed, compared) = decoder[0], decoder[1]
+    path = (name, index) if indexed else name
+    if kind == "list":
+        format = decoder[2]
+        return [((name, i), literal(value)) for i, value in enumerate(format.findall(text))]
+    if kind == "value":
+        value = literal(text)
+    elif kind == "comment":
+        value = text == ""
+    elif kind == "cbool":
+        value = text == "true"
+    elif kind == "int":
+        value = int(text)
+    elif kind == "choice":
+        value = text == decoder[2]
+    if compared is not None:
+        #NAME==N only tells us the value when the comparison held
+        return [(path, literal(compared))] if value else []
+    return [(path, value)]
+
+
+class Importer(object):
+    """
+    reads values back out of files produced by one template output. The
+    template is split into lines the same way Templite splits it; lines
+    without code must appear unchanged, and every line with simple
+    expressions (NAME, NAME[i], comment(), cbool(), int(), a if NAME else b
+    and emit loops over NAME[i]) becomes a LinePattern.
+    """
+    def __init__(self, module, output=None, start="${", end="}$"):
+        outputs = load_outputs(module)
+        if output is None:
+            output = sorted(outputs)[0]
+        self.output = output
+        self.defaults = load_settings(module, {})
+        self.static = set()
+        self.patterns = []
+        delimiter = re.compile("%s(.*?)%s" % (re.escape(start), re.escape(end)), re.DOTALL)
+        loop_vars = set()
+        lines = [[]]
+        #Included fragments and blocks are matched as if written out in place
+        for i, part in enumerate(delimiter.split(fragments.expand(outputs[output], start, end))):
+            if i % 2 == 0:
+                pieces = part.split("\n")
+                lines[-1].append(("text", pieces[0]))
+                lines.extend([("text", piece)] for piece in pieces[1:])
+                continue
+            code = part.strip()
+            loop = _loop.match(code)
+            if loop and code.endswith(":"):
+                loop_vars.add(loop.group(1))
+            elif code and not code.startswith(":") and not code.endswith(":"):
+                lines[-1].append(("code", code))
+        for line in lines:
+            self._add_line(line, loop_vars)
+        #Template text that is also what a line pattern renders, e.g. "// #define ENDSTOPPULLUP_XMAX"
+        self.ambiguous = set(text for text in self.static
+                             if any(pattern.match(text) is not None for pattern in self.patterns))
+
+    def _add_line(self, line, loop_vars):
+        if not any(kind == "code" for kind, text in line):
+            text = "".join(text for kind, text in line).strip()
+            if text:
+                self.static.add(text)
+            return
+        regex = [r"^\s*"]
+        decoders = []
+        literals = []
+        last_code = max(i for i, (kind, text) in enumerate(line) if kind == "code")
+        leading = True
+        for i, (kind, text) in enumerate(line):
+            if kind == "text":
+                if leading:
+                    #Indentation is matched by the leading \s*
+                    text = text.lstrip()
+                    leading = not text
+                if i > last_code and "//" in text:
+                    #Trailing comments are often edited or dropped, see below
+                    text = text.split("//", 1)[0].rstrip()
+                regex.append(self._text(text))
+                literals.append(text.strip())
+            else:
+                leading = False
+                capture, decoder = self._code(text, loop_vars)
+                regex.append(capture)
+                if decoder:
+                    decoders.append(decoder)
+        regex.append(r"(?:\s*//.*)?\s*$")
+        #Lines with only computed values (e.g. NUM_AXIS) get a pattern without decoders
+        anchor = max(" ".join(literals).split() or [""], key=len)
+        self.patterns.append(LinePattern("".join(regex), decoders, anchor))
+
+    def _text(self, text):
+        return "".join(r"\s+" if i % 2 else re.escape(piece)
+                       for i, piece in enumerate(_whitespace.split(text)))
+
+    def _code(self, code, loop_vars):
+        #Returns the regex for one expression plus its decoder, or None for a wildcard
+        if code in loop_vars:
+            return r"(\d+)", ("index",)
+        match = _list.match(code)
+        if match and match.group(3).count("%") == 1 and _format.search(match.group(3)):
+            #A loop emitting one formatted item per index, e.g. ", %f" % E_STEPS_PER_MM[i]
+            item = re.escape(match.group(3)).replace("\\%", "%")
+            values = re.compile(_format.sub(lambda m: "(%s)" % _format_patterns[m.group(1)], item))
+            item = _format.sub(lambda m: _format_patterns[m.group(1)], item)
+            return r"((?:%s)*)" % item, ("list", (match.group(4), False, None), values)
+        match = _emit.match(code)
+        inner = match.group(1).strip() if match else code
+        call = _call.match(inner)
+        choice = _choice.match(inner)
+        if call:
+            target = self._target(call.group(2).strip(), loop_vars)
+            if target:
+                captures = {"comment": r"(|//)", "cbool": r"(true|false)", "int": r"(-?\d+)"}
+                return captures[call.group(1)], (call.group(1), target)
+        elif choice:
+            target = self._target(choice.group(2).strip(), loop_vars)
+            if target:
+                a, b = choice.group(1), choice.group(3)
+                return r"(%s|%s)" % (re.escape(a), re.escape(b)), ("choice", target, a)
+        elif not match:
+            target = self._target(inner, loop_vars)
+            if target and target[2] is None:
+                return r"(.+?)", ("value", target)
+        return r".*?", None
+
+    def _target(self, expression, loop_vars):
+        match = _target.match(expression)
+        if match is None or (match.group(2) and match.group(2) not in loop_vars):
+            return None
+        return match.group(1), bool(match.group(2)), match.group(3)
+
+    def parse(self, text):
+        """
+        returns (settings, unmatched): a dictionary of store values found in
+        text, suitable for VariableStore.update, and a list of (line number,
+        line) for non-blank lines that are neither template text nor matched
+        by a pattern. Lines that could be either only give values for keys
+        no other line sets.
+        """
+        found = {}
+        columns = {}
+        unmatched = []
+        decoded = ([], [])
+        for number, line in enumerate(text.splitlines(), 1):
+            stripped = line.strip()
+            if not stripped:
+                continue
+            static = stripped in self.static
+            if static and stripped not in self.ambiguous:
+                continue
+            for pattern in self.patterns:
+                values = pattern.match(line)
+                if values is not None:
+                    break
+            else:
+                if not static:
+                    unmatched.append((number, line))
+                continue
+            try:
+                values = [(path, self._coerce(path[0] if isinstance(path, tuple) else path, value))
+                          for path, value in values]
+            except (ValueError, TypeError):
+                if not static:
+                    unmatched.append((number, line))
+                continue
+            decoded[static].extend(values)
+        for static, values in enumerate(decoded):
+            for path, value in values:
+                if isinstance(path, tuple):
+                    name, index = path
+                    column = columns.setdefault(name, {})
+                    if not static or index not in column:
+                        column[index] = value
+                elif not static or path not in found:
+                    found[path] = value
+        for name, values in columns.items():
+            column = list(self.defaults.get(name, ()))
+            size = max(values) + 1
+            column.extend([column[-1] if column else None] * (size - len(column)))
+            for index, value in values.items():
+                column[index] = value
+            found[name] = column[:size]
+        return found, unmatched
+
+    def _coerce(self, name, value):
+        #Values take the type of the template default for that key
+        default = self.defaults.get(name)
+        kind = default.kind if isinstance(default, vstore.Column) else type(default)
+        if kind in (bool, int, float) and not isinstance(value, kind):
+            if isinstance(value, basestring):
+                raise ValueError("%r is not a %s" % (value, kind.__name__))
+            return kind(value)
+        return value
+
+    def parse_file(self, path):
+        with open(path, "r") as fp:
+            return self.parse(fp.read())
+
+
+def find_files(paths, pattern):
+    """
+    yields (root, path) for every file given directly and every file
+    matching pattern below the given directories.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if fnmatch.fnmatch(name.lower(), pattern.lower()):
+                        yield path, os.path.join(directory, name)
+        else:
+            yield os.path.dirname(path), path
+
+
+_importer = None
+
+
+def _init_worker(template_path, output):
+    global _importer
+    _importer = Importer(load_module(template_path), output)
+
+
+def _import_file(job):
+    root, path, directory = job
+    settings, unmatched = _importer.parse_file(path)
+    if directory is not None:
+        target = os.path.join(directory, os.path.splitext(os.path.relpath(path, root))[0] + ".json")
+        if not os.path.isdir(os.path.dirname(target)):
+            try:
+                os.makedirs(os.path.dirname(target))
+            except OSError:
+                pass #Created by another worker
+        with open(target, "w") as fp:
+            json.dump(settings, fp, indent=1, sort_keys=True)
+    return path, len(settings), unmatched
+
+
+def import_files(template_path, paths, directory=None, output=None, processes=None,
+                 pattern="Configuration.h"):
+    """
+    parses every matching file across worker processes, writing one settings
+    JSON per file below directory. Yields (path, key count, unmatched lines)
+    as files finish.
+    """
+    jobs = ((root, path, directory) for root, path in find_files(paths, pattern))
+    if processes == 1:
+        _init_worker(template_path, output)
+        for job in jobs:
+            yield _import_file(job)
+        return
+    pool = multiprocessing.Pool(processes, _init_worker, (template_path, output))
+    try:
+        for result in pool.imap_unordered(_import_file, jobs, chunksize=16):
+            yield result
+    finally:
+        pool.terminate()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read settings back out of exported configuration files")
+    parser.add_argument("template", help="template module, e.g. templates/marlin.py")
+    parser.add_argument("inputs", nargs="+", help="configuration files or directories to search")
+    parser.add_argument("-o", "--output", help="directory for the settings JSON files")
+    parser.add_argument("--template-output", help="template output the files were made from")
+    parser.add_argument("--pattern", default="Configuration.h", help="file name pattern inside directories")
+    parser.add_argument("-j", "--processes", type=int, help="worker processes (default: one per CPU)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="list every unmatched line")
+    args = parser.parse_args()
+
+    start = time.time()
+    files = unmatched_lines = 0
+    for path, keys, unmatched in import_files(args.template, args.inputs, args.output, args.template_output,
+                                              args.processes, args.pattern):
+        files += 1
+        unmatched_lines += len(unmatched)
+        if args.verbose:
+            for number, line in unmatched:
+                print("%s:%i: %s" % (path, number, line))
+    elapsed = time.time() - start
+    print("imported %i files in %.2fs (%.0f files/s), %i unmatched lines"
+          % (files, elapsed, files / elapsed if elapsed else 0, unmatched_lines))
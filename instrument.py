@@ -0,0 +1,79 @@
+import os
+import json
+import atexit
+import threading
+from timeit import default_timer
+from contextlib import contextmanager
+
+enabled = False
+trace_path = None
+events = []
+counters = {}
+_origin = default_timer()
+
+
+def _now():
+    return (default_timer() - _origin) * 1e6
+
+
+def enable(path):
+    """
+    starts recording spans and counters, which are written to path as
+    Chrome trace JSON (viewable in chrome://tracing or Perfetto) on exit.
+    """
+    global enabled, trace_path
+    if not enabled:
+        atexit.register(dump)
+    enabled = True
+    trace_path = path
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    del events[:]
+    counters.clear()
+
+
+@contextmanager
+def span(name, **args):
+    if not enabled:
+        yield
+        return
+    start = _now()
+    try:
+        yield
+    finally:
+        events.append({"name": name, "ph": "X", "ts": start, "dur": _now() - start,
+                       "pid": os.getpid(), "tid": threading.current_thread().ident,
+                       "args": args})
+
+
+def count(name, key, amount=1):
+    try:
+        group = counters[name]
+    except KeyError:
+        group = counters[name] = {}
+    group[key] = group.get(key, 0) + amount
+
+
+def dump(path=None):
+    """
+    writes every recorded span plus one counter event per counter group.
+    """
+    path = path or trace_path
+    if not path:
+        return
+    trace = list(events)
+    for name, group in counters.items():
+        trace.append({"name": name, "ph": "C", "ts": _now(), "pid": os.getpid(),
+                      "args": dict((str(key), value) for key, value in group.items())})
+    with open(path, "w") as fp:
+        json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, fp)
+
+
+if os.environ.get("GUICONFIG_TRACE"):
+    enable(os.environ["GUICONFIG_TRACE"])
@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from Queue import Queue, Empty
+
+import vstore
+import export
+import instrument
+
+_stop = object()
+
+#Paths of the journals being recorded, so two windows never share one
+_active = set()
+
+
+def journal_path(directory, template):
+    """
+    returns the journal path for a template. Templates with the same file
+    name in different directories get different journals, and a path
+    another open journal is using gets a numbered suffix.
+    """
+    name = "%s-%s" % (os.path.splitext(os.path.basename(template))[0],
+                      hashlib.sha1(os.path.abspath(template)).hexdigest()[:12])
+    path = os.path.join(directory, name + ".journal")
+    number = 1
+    while path in _active:
+        number += 1
+        path = os.path.join(directory, "%s-%i.journal" % (name, number))
+    return path
+
+
+class Journal(object):
+    """
+    a write-behind autosave of a VariableStore. Every write to the store is
+    appended to path as one JSON line [path, value] by a background thread,
+    which fsyncs once per batch. Once the journal grows past compact_size
+    bytes the whole store is written to path + ".snapshot" and the journal
+    starts over.
+    """
+    def __init__(self, path, store, compact_size=1 << 20, interval=0.5):
+        self.path = path
+        self.snapshot_path = path + ".snapshot"
+        self.store = store
+        self.compact_size = compact_size
+        self.interval = interval
+        self.records = 0
+        self.skipped = []
+        self.syncs = 0
+        self.compactions = 0
+        self._size = 0
+        self._queue = Queue()
+        self._thread = None
+        self._watcher = None
+        self._file = None
+
+    def replay(self):
+        """
+        applies the snapshot and then every journal record to the store.
+        Returns the number of records replayed. A record cut short by a
+        crash ends the replay; records for keys or indices the template no
+        longer has are skipped and kept in self.skipped.
+        """
+        try:
+            with open(self.snapshot_path, "r") as fp:
+                self.store.update(json.load(fp))
+        except (IOError, ValueError):
+            pass
+        count = 0
+        try:
+            with open(self.path, "r") as fp:
+                for line in fp:
+                    try:
+                        path, value = json.loads(line)
+                    except ValueError:
+                        break
+                    try:
+                        self.store.setr(path, value)
+                    except (KeyError, IndexError, TypeError, ValueError) as error:
+                        self.skipped.append((path, value, error))
+                        instrument.count("journal", "skipped records")
+                        continue
+                    count += 1
+        except IOError:
+            pass
+        return count
+
+    def start(self):
+        """
+        starts recording writes to the store.
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        _active.add(self.path)
+        self._file = open(self.path, "a")
+        self._size = self._file.tell()
+        self._thread = threading.Thread(target=self._run, name="journal %s" % os.path.basename(self.path))
+        self._thread.daemon = True
+        self._thread.start()
+        self._watcher = self.store.add_watcher(self.record)
+
+    def record(self, path, value):
+        #Runs on the writing thread: encode now, write and fsync later
+        line = json.dumps([path, value], default=vstore.to_json) + "\n"
+        self._queue.put(("record", line))
+        self._size += len(line)
+        if self._size > self.compact_size:
+            self.compact()
+
+    def compact(self):
+        """
+        queues a snapshot of the whole store, after which the journal is
+        emptied.
+        """
+        self._queue.put(("snapshot", json.dumps(self.store, default=vstore.to_json)))
+        self._size = 0
+
+    def reset(self):
+        """
+        starts the journal over from the store as it is now, e.g. after the
+        settings were saved or loaded, so earlier records are not replayed
+        over them.
+        """
+        self.compact()
+
+    def flush(self):
+        """
+        waits until everything recorded so far is on disk.
+        """
+        self._queue.join()
+
+    def close(self):
+        if self._watcher:
+            self._watcher.remove()
+            self._watcher = None
+        if self._thread:
+            self._queue.put(_stop)
+            self._thread.join()
+            self._thread = None
+            self._file.close()
+            _active.discard(self.path)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.time() + self.interval
+            while batch[-1] is not _stop:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.time(), 0)))
+                except Empty:
+                    break
+            try:
+                self._write(batch)
+            finally:
+                for item in batch:
+                    self._queue.task_done()
+            if batch[-1] is _stop:
+                return
+
+    def _write(self, batch):
+        for item in batch:
+            if item is _stop:
+                continue
+            kind, text = item
+            if kind == "record":
+                self._file.write(text)
+                self.records += 1
+            else:
+                #A snapshot covers every record before it
+                self._sync()
+                export.atomic_write(self.snapshot_path, text, sync=True)
+                self._file.seek(0)
+                self._file.truncate()
+                self.compactions += 1
+        self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.syncs += 1
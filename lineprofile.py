@@ -0,0 +1,159 @@
+import ast
+import sys
+import json
+import argparse
+from timeit import default_timer
+
+import export
+from templite import Templite
+
+
+class LineProfiler(object):
+    """
+    records how often each line of a Templite template runs and how long it
+    takes. Times are inclusive: a line's time covers the helpers it calls.
+    Tracing slows rendering down, so compare lines with each other rather
+    than with unprofiled render times.
+    """
+    def __init__(self, template):
+        self.template = template
+        self.hits = {}
+        self.times = {}
+        self.renders = 0
+        self._frames = {}
+        #Python also reports the later lines of a multi-line text argument, so only these start a line
+        self._starts = set(node.lineno for node in ast.walk(ast.parse(template.source))
+                           if isinstance(node, ast.stmt))
+
+    def render(self, __namespace=None, **kw):
+        """
+        renders the template like Templite.render while recording line timings.
+        """
+        previous = sys.gettrace()
+        sys.settrace(self._trace)
+        try:
+            return self.template.render(__namespace, **kw)
+        finally:
+            sys.settrace(previous)
+            self._frames.clear()
+            self.renders += 1
+
+    def _trace(self, frame, event, arg):
+        if frame.f_code.co_filename != self.template.filename:
+            return None
+        return self._trace_line
+
+    def _trace_line(self, frame, event, arg):
+        now = default_timer()
+        key = id(frame)
+        current = self._frames.get(key)
+        if current is not None:
+            line, start, generated = current
+            self.times[line] = self.times.get(line, 0.0) + now - start
+        if event == "return":
+            self._frames.pop(key, None)
+            return None
+        if event == "line":
+            generated = frame.f_lineno
+            if generated in self._starts or current is None:
+                line = self.template.line_map[generated]
+                #A template line becomes several statements; it runs again when entered anew or a loop jumps back
+                if current is None or current[0] != line or generated <= current[2]:
+                    self.hits[line] = self.hits.get(line, 0) + 1
+            else:
+                line, generated = current[0], current[2]
+            #Leave the tracer's own time out of the line
+            self._frames[key] = (line, default_timer(), generated)
+        return self._trace_line
+
+    def total(self):
+        return sum(self.times.values())
+
+    def blocks(self):
+        """
+        returns (first line, last line, code, time, hits) for every block
+        statement of the template, e.g. ${for i in range(EXTRUDERS):}$, with
+        the time of the lines inside it.
+        """
+        blocks = []
+        generated = self.template.source.splitlines()
+        for node in ast.walk(ast.parse(self.template.source)):
+            if not isinstance(node, (ast.For, ast.While, ast.If, ast.With, ast.TryExcept, ast.TryFinally,
+                                     ast.FunctionDef)):
+                continue
+            last = max(getattr(child, "lineno", node.lineno) for child in ast.walk(node))
+            first, last = self.template.line_map[node.lineno], self.template.line_map[last]
+            lines = range(first, last + 1)
+            blocks.append((first, last, generated[node.lineno - 1].strip(),
+                           sum(self.times.get(line, 0.0) for line in lines), self.hits.get(first, 0)))
+        return sorted(blocks, key=lambda block: -block[3])
+
+    def report(self, source, limit=20):
+        """
+        returns the slowest lines and blocks as text. source is the template
+        text, used to show each line.
+        """
+        lines = source.splitlines()
+        total = self.total() or 1.0
+        renders = self.renders or 1
+        out = ["%i renders, %.1fus per render (traced)" % (self.renders, self.total() / renders * 1e6), "",
+               "%8s %10s %6s  %5s  %s" % ("hits", "us/render", "%", "line", "template")]
+        for line in sorted(self.times, key=lambda line: -self.times[line])[:limit]:
+            out.append("%8i %10.2f %5.1f%%  %5i  %s" % (self.hits.get(line, 0) / renders,
+                                                       self.times[line] / renders * 1e6,
+                                                       100 * self.times[line] / total, line,
+                                                       lines[line - 1].strip()[:60] if line <= len(lines) else ""))
+        blocks = self.blocks()[:limit]
+        if blocks:
+            out.extend(["", "%10s %6s  %11s  %s" % ("us/render", "%", "lines", "block")])
+            for first, last, code, time, hits in blocks:
+                out.append("%10.2f %5.1f%%  %5i-%-5i  %s" % (time / renders * 1e6, 100 * time / total,
+                                                             first, last, code[:60]))
+        return "\n".join(out)
+
+    def annotate(self, source):
+        """
+        returns the template text with the hits, time per render and share
+        of the total in front of every line that ran.
+        """
+        total = self.total() or 1.0
+        renders = self.renders or 1
+        out = []
+        for number, text in enumerate(source.splitlines(), 1):
+            if number in self.hits:
+                time = self.times.get(number, 0.0)
+                prefix = "%7i %9.2f %5.1f%% |" % (self.hits[number] / renders, time / renders * 1e6,
+                                                  100 * time / total)
+            else:
+                prefix = "%24s |" % ""
+            out.append(prefix + " " + text)
+        return "\n".join(out) + "\n"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile template rendering line by line")
+    parser.add_argument("template", help="template module, e.g. templates/marlin.py")
+    parser.add_argument("settings", nargs="?", help="saved settings JSON file (default: template defaults)")
+    parser.add_argument("--output", help="template output to profile (default: all)")
+    parser.add_argument("-n", "--renders", type=int, default=100, help="renders to average over")
+    parser.add_argument("--limit", type=int, default=20, help="lines and blocks to list")
+    parser.add_argument("--annotate", metavar="SUFFIX",
+                        help="also write each output's annotated template to <output><SUFFIX>")
+    args = parser.parse_args()
+
+    module = export.load_module(args.template)
+    settings = {}
+    if args.settings:
+        with open(args.settings, "r") as fp:
+            settings = json.load(fp)
+    store = export.load_settings(module, settings)
+    for name, contents in sorted(export.load_outputs(module).items()):
+        if args.output and name != args.output:
+            continue
+        profiler = LineProfiler(Templite(contents))
+        for i in range(args.renders):
+            profiler.render(store, **export.helpers)
+        print("%s\n%s\n" % (name, profiler.report(contents, args.limit)))
+        if args.annotate:
+            with open(name + args.annotate, "w") as fp:
+                fp.write(profiler.annotate(contents))
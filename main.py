@@ -1,21 +1,23 @@
 import wx
 #import wx.lib.inspection
 import os
-import imp
 import json
 from templite import Templite
 
 import vstore
+import export
+import instrument
+import search
+import catalog
+import journal
+from export import load_module
 
 
 outputs = {}
 open_dir = os.path.join(os.path.dirname(__file__),"templates")
 load_save_dir = os.path.expanduser("~")
 export_dir = os.path.expanduser("~")
-
-
-def load_module(path):
-    return imp.load_source(os.path.splitext(os.path.basename(path))[0], path)
+autosave_dir = os.path.join(os.path.expanduser("~"), ".guiconfig", "autosave")
 
 
 class MainFrame(wx.Frame):
@@ -27,9 +29,26 @@ class MainFrame(wx.Frame):
         self.panel = wx.Panel(self)
         self.sizer = wx.BoxSizer(wx.VERTICAL)
         self.panel.SetSizer(self.sizer)
+        self.search_ctrl = wx.SearchCtrl(self.panel, style=wx.TE_PROCESS_ENTER)
+        self.search_ctrl.Enable(False)
+        self.results = wx.ListBox(self.panel, style=wx.LB_SINGLE, size=(-1, 100))
+        self.results.Hide()
+        self.gui_sizer = wx.BoxSizer(wx.VERTICAL)
+        self.sizer.Add(self.search_ctrl, 0, wx.EXPAND | wx.LEFT | wx.RIGHT | wx.TOP, 5)
+        self.sizer.Add(self.results, 0, wx.EXPAND | wx.LEFT | wx.RIGHT, 5)
+        self.sizer.Add(self.gui_sizer, 1, wx.EXPAND)
+        self.Bind(wx.EVT_TEXT, self.on_search, self.search_ctrl)
+        self.Bind(wx.EVT_TEXT_ENTER, self.on_search_enter, self.search_ctrl)
+        self.Bind(wx.EVT_LISTBOX, self.on_search_result, self.results)
+        self.Bind(wx.EVT_CLOSE, self.on_close)
         self.sizer.Fit(self.panel)
         self.SetMinSize(self.GetSize())
         self.parent = None
+        self.search = None
+        self.journal = None
+        self.found = []
+        #Each window edits its own document
+        self.store = vstore.VariableStore()
         
 
     def create_menu_bar(self):
@@ -58,6 +77,53 @@ class MainFrame(wx.Frame):
         
     def on_open(self, event):
         global open_dir, outputs
+        path = self.choose_template()
+        if path:
+            open_dir = os.path.dirname(path)
+            with instrument.span("open", path=path):
+                with instrument.span("load_module"):
+                    module = load_module(path)
+                if self.journal:
+                    self.journal.close()
+                self.store.clear()
+                with instrument.span("load_defaults"):
+                    export.load_defaults(module, self.store)
+                with instrument.span("replay journal"):
+                    self.journal = journal.Journal(journal.journal_path(autosave_dir, path), self.store)
+                    self.journal.replay()
+                    self.journal.start()
+                with instrument.span("load_gui"):
+                    self.gui = export.load_gui(module, self.store)
+                self.gui_sizer.Clear(True)
+                with instrument.span("build_gui"):
+                    self.gui_sizer.Add(self.gui.build_gui(self.panel), 1, wx.ALL|wx.EXPAND, 5)
+                with instrument.span("search index"):
+                    self.search = search.SearchIndex(self.gui)
+                with instrument.span("layout"):
+                    self.sizer.Layout()
+                    self.gui.layout()
+                with instrument.span("load_outputs"):
+                    outputs = export.load_outputs(module)
+                if instrument.enabled:
+                    for key, count in self.store.binding_counts().items():
+                        instrument.count("bindings", key, count)
+            self.m_load.Enable(True)
+            self.m_save.Enable(True)
+            self.m_export.Enable(True)
+            self.search_ctrl.Enable(True)
+        
+    def choose_template(self):
+        #Lists the catalogued templates so only the chosen module gets imported
+        templates = catalog.Catalog(open_dir)
+        with instrument.span("catalog"):
+            entries = templates.refresh()
+        choices = [templates.describe(entry) for entry in entries] + ["Browse..."]
+        dlg = wx.SingleChoiceDialog(self, "Choose a template", "Open Template", choices)
+        if dlg.ShowModal() != wx.ID_OK:
+            return None
+        if dlg.GetSelection() < len(entries):
+            return os.path.join(open_dir, entries[dlg.GetSelection()]["file"])
+
         wildcard = "Py files (*.py)|*.py|" \
            "All files (*.*)|*.*"
         dlg = wx.FileDialog(
@@ -67,21 +133,9 @@ class MainFrame(wx.Frame):
             wildcard=wildcard,
             style=wx.FD_OPEN | wx.FD_FILE_MUST_EXIST
             )
-        
         if dlg.ShowModal() == wx.ID_OK:
-            open_dir = os.path.dirname(dlg.GetPath())
-            module = load_module(dlg.GetPath())
-            vstore.instance.clear()
-            module.load_defaults()
-            self.gui = module.load_gui()
-            self.sizer.Clear(True)
-            self.sizer.Add(self.gui.build_gui(self.panel), 1, wx.ALL|wx.EXPAND, 5)
-            self.sizer.Layout()
-            self.gui.layout()
-            outputs = module.load_outputs()
-            self.m_load.Enable(True)
-            self.m_save.Enable(True)
-            self.m_export.Enable(True)
+            return dlg.GetPath()
+        return None
         
     def on_load(self, event):
         global load_save_dir
@@ -99,8 +153,20 @@ class MainFrame(wx.Frame):
             load_save_dir = os.path.dirname(dlg.GetPath())
             with open(dlg.GetPath(), "r") as fp:
                 data = json.load(fp)
-                vstore.instance.update(data)
-                self.gui.refresh()
+            with instrument.span("load settings", path=dlg.GetPath()):
+                #Layouts requested by the update are flushed once, after Thaw
+                self.Freeze()
+                try:
+                    with instrument.span("update"):
+                        changed = self.store.update(data)
+                    with instrument.span("refresh", keys=len(changed)):
+                        refreshed = self.gui.refresh_keys(changed)
+                finally:
+                    self.Thaw()
+                self.journal.reset()
+                if instrument.enabled:
+                    instrument.count("refresh", "widgets", refreshed)
+                    instrument.count("refresh", "changed settings", len(changed))
         
     def on_save(self, event):
         global load_save_dir
@@ -117,7 +183,8 @@ class MainFrame(wx.Frame):
         if dlg.ShowModal() == wx.ID_OK:
             load_save_dir = os.path.dirname(dlg.GetPath())
             with open(dlg.GetPath(), "w") as fp:
-                json.dump(vstore.instance, fp)
+                json.dump(self.store, fp, default=vstore.to_json)
+            self.journal.reset()
         
     def on_export(self, event):
         global export_dir, outputs        
@@ -133,15 +200,32 @@ class MainFrame(wx.Frame):
             if dlg.ShowModal() == wx.ID_OK:
                 export_dir = os.path.dirname(dlg.GetPath())
                 filename = dlg.GetPath()
-                template = Templite(contents)                
-                def cbool(bool):
-                    return str(bool).lower()
-                def comment(bool):
-                    return "" if bool else "//"
-                with open(filename, "w") as fh:
-                    fh.write(template.render(vstore.instance, cbool=cbool, comment=comment))
+                with instrument.span("Templite compile", output=output):
+                    template = Templite(contents)
+                with instrument.span("Templite.render", output=output):
+                    text = template.render(self.store, **export.helpers)
+                manifest = export.Manifest(export_dir)
+                manifest.write(os.path.basename(filename), text)
+                manifest.save()
     
+    def on_search(self, event):
+        text = self.search_ctrl.GetValue()
+        with instrument.span("search", query=text):
+            self.found = self.search.query(text, limit=50) if self.search else []
+        self.results.Set([self.search.describe(part) for part in self.found])
+        self.results.Show(bool(self.found))
+        self.sizer.Layout()
+
+    def on_search_enter(self, event):
+        if self.found:
+            self.found[0].reveal()
+
+    def on_search_result(self, event):
+        self.found[self.results.GetSelection()].reveal()
+
     def on_close(self, event):
+        if self.journal:
+            self.journal.close()
         self.Destroy()
     
 if __name__ == "__main__":
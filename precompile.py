@@ -0,0 +1,173 @@
+import os
+import sys
+import imp
+import ast
+import hashlib
+import tokenize
+import argparse
+from StringIO import StringIO
+from templite import Templite, Output, free_names, fragments, render_names
+
+
+compiled_dirname = "compiled"
+
+#Bumped whenever generated modules change shape, so older ones are rebuilt
+format_version = 3
+
+_header = '''# -*- coding: utf-8 -*-
+# Generated by precompile.py from %(template)s output %(output)r. Do not edit.
+import __builtin__
+
+FORMAT = %(format)r
+TEMPLATE_HASH = %(hash)r
+SOURCE_HASH = %(digest)r
+NAMES = %(names)r
+USES_PRINT = %(uses_print)r
+
+_missing = object()
+_builtin = __builtin__.__dict__.get
+_empty = {}
+
+
+def render(kw, ns, out):
+\t_append = out.append
+\tdef emit(*args):
+\t\tfor a in args:
+\t\t\t_append(str(a))
+\t_kw = kw.get
+\t_ns = (_empty if ns is None else ns).get
+'''
+
+#A name missing from kw, ns and the builtins stays unbound, so like Templite only using it raises NameError
+_lookup = '''\t_found = _kw(%(name)r, _missing)
+\tif _found is _missing:
+\t\t_found = _ns(%(name)r, _missing)
+\t\tif _found is _missing:
+\t\t\t_found = _builtin(%(name)r, _missing)
+\tif _found is not _missing:
+\t\t%(name)s = _found
+'''
+
+
+def template_hash(contents):
+    if isinstance(contents, unicode):
+        contents = contents.encode("utf-8")
+    return hashlib.sha1(contents).hexdigest()
+
+
+def compiled_path(template_path, output):
+    """
+    returns the path of the module generated for one output of a template,
+    e.g. templates/compiled/marlin__configuration_h.py
+    """
+    directory, filename = os.path.split(os.path.abspath(template_path))
+    name = "%s__%s" % (os.path.splitext(filename)[0],
+                       "".join(c if c.isalnum() else "_" for c in output))
+    return os.path.join(directory, compiled_dirname, name + ".py")
+
+
+def generate(template_path, output, contents):
+    """
+    returns the source of a module with a render(kw, ns, out) function that
+    appends the rendered text of contents to the list out. Names the template
+    reads are looked up once, from kw, ns or the builtins, when render
+    starts; everything else runs as plain function code. NAMES and
+    SOURCE_HASH match Templite(contents), so both engines share render cache
+    entries.
+    """
+    original = Templite(contents)
+    contents = fragments.expand(contents)
+    template = Templite(contents)
+    loaded, stored = free_names(template.source)
+    names = original.names
+    uses_print = any(isinstance(node, ast.Print) for node in ast.walk(ast.parse(template.source)))
+    lines = [_header % {"template": os.path.basename(template_path), "output": output,
+                        "format": format_version, "hash": template_hash(contents), "digest": original.digest,
+                        "names": None if names is None else tuple(sorted(names)), "uses_print": uses_print}]
+    #Names the template also assigns are looked up too, as Templite reads them from the namespace until then
+    for name in sorted(loaded - render_names):
+        lines.append(_lookup % {"name": name})
+    inside_strings = _string_continuation_lines(template.source)
+    for number, line in enumerate(template.source.splitlines(), 1):
+        if number in inside_strings:
+            lines.append(line + "\n")
+        else:
+            lines.append("\t%s\n" % line if line.strip() else "\n")
+    lines.append("\tpass\n")
+    return "".join(lines)
+
+
+def _string_continuation_lines(source):
+    #Lines that continue a multi-line string literal must not be indented
+    lines = set()
+    for type, text, start, end, line in tokenize.generate_tokens(StringIO(source).readline):
+        if type == tokenize.STRING and end[0] > start[0]:
+            lines.update(range(start[0] + 1, end[0] + 1))
+    return lines
+
+
+def build(template_path):
+    """
+    writes one compiled module for every output of the template module.
+    Returns the list of generated paths.
+    """
+    module = imp.load_source(os.path.splitext(os.path.basename(template_path))[0], template_path)
+    fragments.load(module)
+    paths = []
+    for output, contents in sorted(module.load_outputs().items()):
+        path = compiled_path(template_path, output)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as fh:
+            fh.write(generate(template_path, output, contents))
+        paths.append(path)
+    return paths
+
+
+class CompiledTemplate(object):
+    """
+    a precompiled template output with the same render interface as Templite.
+    """
+    def __init__(self, module):
+        self.module = module
+        self.digest = module.SOURCE_HASH
+        self.names = None if module.NAMES is None else frozenset(module.NAMES)
+
+    def render(self, __namespace=None, **kw):
+        output = Output()
+        if self.module.USES_PRINT:
+            __stdout = sys.stdout
+            sys.stdout = output
+            try:
+                self.module.render(kw, __namespace, output)
+            finally:
+                sys.stdout = __stdout
+        else:
+            self.module.render(kw, __namespace, output)
+        return ''.join(output)
+
+
+def load(template_path, output, contents):
+    """
+    returns a CompiledTemplate for one template output, or None when it has
+    not been built or was built from different template contents.
+    """
+    path = compiled_path(template_path, output)
+    if not os.path.exists(path):
+        return None
+    name = "_guiconfig_compiled_" + os.path.splitext(os.path.basename(path))[0]
+    module = imp.load_source(name, path)
+    #Hashed with fragments written out, so editing a fragment invalidates the module
+    if getattr(module, "FORMAT", 1) != format_version or \
+            module.TEMPLATE_HASH != template_hash(fragments.expand(contents)):
+        return None
+    return CompiledTemplate(module)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile template outputs into importable Python modules")
+    parser.add_argument("templates", nargs="+", help="template modules, e.g. templates/marlin.py")
+    args = parser.parse_args()
+    for template_path in args.templates:
+        for path in build(template_path):
+            print("wrote %s" % path)
@@ -0,0 +1,147 @@
+import os
+import json
+import types
+import marshal
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+import vstore
+
+
+class _Uncacheable(Exception):
+    #Raised for values whose state a key cannot capture
+    pass
+
+
+class RenderCache(object):
+    """
+    an on-disk cache of rendered template text with least-recently-used
+    eviction. Entries are keyed by the compiled template's digest plus a
+    canonical hash of only the namespace values the template reads, so
+    settings that differ in keys a template ignores share one rendering.
+    """
+    def __init__(self, directory, max_entries=10000):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        #Renders whose inputs had no canonical form, rendered without the cache
+        self.uncached = 0
+        self._function_ids = {}
+        #Guards the LRU order and counters when several threads render at once
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        #Rebuild the LRU order from file modification times
+        entries = []
+        for root, dirs, files in os.walk(directory):
+            for name in files:
+                if not name.startswith("."):
+                    entries.append((os.path.getmtime(os.path.join(root, name)), name))
+        self._entries = OrderedDict((name, None) for mtime, name in sorted(entries))
+
+    def key(self, template, namespace=None, kw={}):
+        """
+        returns the cache key for rendering template with namespace and kw,
+        or None when the template's inputs cannot be determined statically
+        or one of the values it reads has no canonical form.
+        """
+        names = template.names
+        if names is None:
+            return None
+        values = {}
+        missing = []
+        for name in names:
+            if name in kw:
+                values[name] = self._tagged(kw[name])
+            elif namespace is not None and name in namespace:
+                values[name] = self._tagged(namespace[name])
+            else:
+                missing.append(name)
+        digest = hashlib.sha1(template.digest)
+        #Absent names are listed apart from the values, so no value can stand for one
+        try:
+            digest.update(json.dumps([values, sorted(missing)], sort_keys=True, default=self._canonical))
+        except _Uncacheable:
+            return None
+        return digest.hexdigest()
+
+    def render(self, template, __namespace=None, **kw):
+        """
+        returns the cached text for these inputs, rendering and storing it on
+        a miss. Takes the same arguments as Templite.render.
+        """
+        key = self.key(template, __namespace, kw)
+        if key is None:
+            with self._lock:
+                self.uncached += 1
+            return template.render(__namespace, **kw)
+        path = self._path(key)
+        try:
+            with open(path, "r") as fh:
+                text = fh.read()
+        except IOError:
+            text = template.render(__namespace, **kw)
+            with self._lock:
+                self.misses += 1
+                self._store(key, path, text)
+            return text
+        with self._lock:
+            self.hits += 1
+            self._entries.pop(key, None)
+            self._entries[key] = None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return text
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _store(self, key, path, text):
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".")
+        with os.fdopen(fd, "w") as fh:
+            fh.write(text)
+        os.rename(temp_path, path)
+        self._entries[key] = None
+        while len(self._entries) > self.max_entries:
+            old, _ = self._entries.popitem(last=False)
+            try:
+                os.remove(self._path(old))
+            except OSError:
+                pass
+
+    def _tagged(self, value):
+        #Containers JSON would write alike (tuple and list, Column and list, dict keys 1 and "1") are tagged
+        if isinstance(value, list):
+            return [self._tagged(item) for item in value]
+        if isinstance(value, tuple):
+            return {"tuple": [self._tagged(item) for item in value]}
+        if isinstance(value, vstore.Column):
+            return {"column": [value.kind.__name__, value.tolist()]}
+        if isinstance(value, (set, frozenset)):
+            return {"set": sorted(self._tagged(item) for item in value)}
+        if isinstance(value, dict):
+            return {"dict": sorted([self._tagged(key), self._tagged(item)] for key, item in value.items())}
+        return value
+
+    def _canonical(self, value):
+        #json default hook: functions are identified by name and bytecode, builtins and classes by name.
+        #Closures and other objects may hold state their name or repr does not show, so they are not cached.
+        if isinstance(value, types.FunctionType) and value.func_closure is None:
+            try:
+                return self._function_ids[value]
+            except KeyError:
+                code = hashlib.sha1(marshal.dumps(value.func_code)).hexdigest()
+                id = self._function_ids[value] = "%s.%s:%s" % (value.__module__, value.__name__, code)
+                return id
+        if isinstance(value, (types.BuiltinFunctionType, type, types.ClassType)) and \
+                getattr(value, "__self__", None) is None:
+            return "%s.%s" % (value.__module__, value.__name__)
+        raise _Uncacheable()
@@ -0,0 +1,131 @@
+import re
+import bisect
+
+_word = re.compile(r"[a-z0-9]+")
+
+#Attributes of a part whose text is searchable
+searched_attributes = ("title", "tooltip", "label", "options", "name")
+
+
+def tokens(text):
+    return _word.findall(text.lower())
+
+
+def part_text(part):
+    """
+    returns the searchable strings of a part: its title, tooltip, label,
+    option texts and store key.
+    """
+    texts = []
+    for attr in searched_attributes:
+        try:
+            value = getattr(part, attr).value
+        except AttributeError:
+            continue
+        if not value:
+            continue
+        if attr == "options":
+            texts.extend(text for id, text in value)
+        elif attr == "name" and not isinstance(value, basestring):
+            texts.append(str(value[0]))
+        else:
+            texts.append(unicode(value))
+    return texts
+
+
+class SearchIndex(object):
+    """
+    an inverted index from lowercase words to the parts of a gui tree that
+    mention them. Query words match any indexed word they are a prefix of, and
+    every query word has to match for a part to be returned.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.words = {}
+        self._sorted = []
+        self._part_words = {}
+        self._order = {}
+        for position, part in enumerate(walk(root)):
+            self._order[part] = position
+            self.add(part)
+            #Func driven attributes are indexed again whenever they change
+            for attr in searched_attributes:
+                try:
+                    dynamic = hasattr(getattr(part, attr)._var, "get_dependencies")
+                except AttributeError:
+                    continue
+                if dynamic:
+                    getattr(part, attr).add_handler(lambda value, part=part: self.update(part))
+
+    def add(self, part):
+        words = set()
+        for text in part_text(part):
+            words.update(tokens(text))
+        self._part_words[part] = words
+        for word in words:
+            try:
+                self.words[word].add(part)
+            except KeyError:
+                self.words[word] = set([part])
+                bisect.insort(self._sorted, word)
+
+    def remove(self, part):
+        for word in self._part_words.pop(part, ()):
+            parts = self.words[word]
+            parts.discard(part)
+            if not parts:
+                del self.words[word]
+                del self._sorted[bisect.bisect_left(self._sorted, word)]
+
+    def update(self, part):
+        self.remove(part)
+        self.add(part)
+
+    def prefix(self, word):
+        #All parts with an indexed word starting with word
+        parts = set()
+        start = bisect.bisect_left(self._sorted, word)
+        for indexed in self._sorted[start:]:
+            if not indexed.startswith(word):
+                break
+            parts.update(self.words[indexed])
+        return parts
+
+    def query(self, text, limit=None):
+        """
+        returns the parts matching every word of text in tree order.
+        """
+        found = None
+        for word in tokens(text):
+            parts = self.prefix(word)
+            found = parts if found is None else found & parts
+            if not found:
+                return []
+        if found is None:
+            return []
+        return sorted(found, key=self._order.get)[:limit]
+
+    def describe(self, part):
+        return describe(part)
+
+
+def describe(part):
+    """
+    returns the titles from the top of the tree down to part, e.g.
+    "General > Extruders > Extruder settings > Temperature sensor".
+    """
+    titles = []
+    while part is not None:
+        try:
+            titles.append(unicode(part.title.value))
+        except AttributeError:
+            pass
+        part = part.parent
+    return " > ".join(reversed(titles))
+
+
+def walk(part):
+    yield part
+    for child in part.children:
+        for descendant in walk(child):
+            yield descendant
@@ -1,16 +1,17 @@
 ﻿import gui_parts as GP
 import vstore
 
-def load_defaults():
+def load_defaults(store=None):
+    if store is None: store = vstore.current()
     #Electronics
-    vstore.instance.update({
+    store.update({
         "MOTHERBOARD": 34,
         "BAUDRATE": 115200,
         "SERIAL_PORT": 0,
         "BTENABLED": 0,
     })
     #Axes
-    vstore.instance.update({
+    store.update({
         "KINEMATIC_CONFIG": 0,
         "X_MIN_POS": 0,
         "X_MAX_POS": 205,
@@ -35,7 +36,7 @@ def load_defaults():
         "Z_MM_PER_S": 5.0,
     })
     #Endstops
-    vstore.instance.update({
+    store.update({
         "ENDSTOPPULLUP_XMAX": True,
         "ENDSTOPPULLUP_YMAX": True,
         "ENDSTOPPULLUP_ZMAX": True,                          
@@ -55,51 +56,44 @@ def load_defaults():
         "MAX_SOFTWARE_ENDSTOPS": True
     })
     #Extruders
-    vstore.instance.update({
+    store.update({
         "EXTRUDERS": 1,
-        "EXTRUDER_SEL": 0,
-        "TEMP_SENSOR": [],
-        "HEATER_MINTEMP": [],
-        "HEATER_MAXTEMP": [],
-        "INVERT_E_DIR": [],
-        "E_STEPS_PER_MM": [],
-        "E_MM_PER_S": [],
     })
     
     #Heated bed
-    vstore.instance.update({
+    store.update({
         "TEMP_SENSOR_BED": -1,
         "BED_MINTEMP": 5,
         "BED_MAXTEMP": 150,
     })
     
-    vstore.instance.add_binding("EXTRUDERS", load_extruder, True) #Load defaults for selected extruder
+    #Per extruder settings, grown with defaults whenever EXTRUDERS increases
+    vstore.IndexedGroup(extruder_fields).install(store, count="EXTRUDERS")
     
     
-def load_extruder(key, count):
-    vs = vstore.instance
-
-    for i in range(count-len(vs["TEMP_SENSOR"])):
-        vs["TEMP_SENSOR"].append(-1)
-        vs["HEATER_MINTEMP"].append(5)
-        vs["HEATER_MAXTEMP"].append(275)
-        vs["INVERT_E_DIR"].append(False)
-        vs["E_STEPS_PER_MM"].append(836.0)
-        vs["E_MM_PER_S"].append(25.0)
+extruder_fields = [
+    ("TEMP_SENSOR", int, -1),
+    ("HEATER_MINTEMP", int, 5),
+    ("HEATER_MAXTEMP", int, 275),
+    ("INVERT_E_DIR", bool, False),
+    ("E_STEPS_PER_MM", float, 836.0),
+    ("E_MM_PER_S", float, 25.0),
+]
 
         
-def load_gui():
-    nb = GP.Notebook()
-    nb.add_children(
-        GP.Tab("General").add_children(
-            electronics_page(),
-            axes_page(),
-            endstops_page(),
-            extruders_page(),
-            heated_bed_page(),
-        ),
-        GP.Tab("Advanced")
-    )
+def load_gui(store=None):
+    with vstore.using(vstore.current() if store is None else store):
+        nb = GP.Notebook()
+        nb.add_children(
+            GP.Tab("General").add_children(
+                electronics_page(),
+                axes_page(),
+                endstops_page(),
+                extruders_page(),
+                heated_bed_page(),
+            ),
+            GP.Tab("Advanced")
+        )
     return nb
     
     
@@ -246,19 +240,13 @@ def extruders_page():
         GP.OptionsGroup("Extruder count").add_children(
             GP.IntegerInput("Extruder count", "EXTRUDERS", min=1, max=3),
         ),        
-        GP.OptionsGroup(GP.Func(["EXTRUDER_SEL"], lambda id: "Extruder %i"%id)).add_children(
-            GP.IntegerInput("Selected extruder", "EXTRUDER_SEL", min=0, max=GP.Func(["EXTRUDERS"],lambda max: max-1),
-                            tooltip="This selects which extruder settings to modify"),
-            GP.OptionsGroup("Temperature control").add_children(
-                sensor_type_input(extruder_var("TEMP_SENSOR")),
-                mintemp_input(extruder_var("HEATER_MINTEMP")),
-                maxtemp_input(extruder_var("HEATER_MAXTEMP")),
-            ),
-            GP.OptionsGroup("Extruder motor").add_children(
-                GP.RealInput("Steps per mm", extruder_var("E_STEPS_PER_MM"), min=0.0, max=1000.0),
-                GP.RealInput("Maximum feedrate", extruder_var("E_MM_PER_S"), label="mm/s", min=0.0, max=1000.0),
-                GP.CheckInput("Invert extruder direction", extruder_var("INVERT_E_DIR"))
-            )
+        GP.RepeatedGroup("Extruder settings", "EXTRUDERS", row_title="Extruder %i").add_children(
+            sensor_type_input("TEMP_SENSOR"),
+            mintemp_input("HEATER_MINTEMP"),
+            maxtemp_input("HEATER_MAXTEMP"),
+            GP.RealInput("Steps per mm", "E_STEPS_PER_MM", min=0.0, max=1000.0),
+            GP.RealInput("Maximum feedrate", "E_MM_PER_S", label="mm/s", min=0.0, max=1000.0),
+            GP.CheckInput("Invert extruder direction", "INVERT_E_DIR"),
         ),
     )
     
@@ -318,10 +306,42 @@ def maxtemp_input(maxtemp_name):
                                    "You should use MINTEMP for thermistor short/failure protection. ")
 
     
-def extruder_var(name):
-    return GP.Func(["EXTRUDER_SEL"], lambda id: (name, id))
-    
-    
+def load_fragments():
+    #Template text shared with other Marlin templates
+    return {
+        "marlin/temp_sensor_table": """//// Temperature sensor settings:
+// -2 is thermocouple with MAX6675 (only for sensor 0)
+// -1 is thermocouple with AD595
+// 0 is not used
+// 1 is 100k thermistor - best choice for EPCOS 100k (4.7k pullup)
+// 2 is 200k thermistor - ATC Semitec 204GT-2 (4.7k pullup)
+// 3 is Mendel-parts thermistor (4.7k pullup)
+// 4 is 10k thermistor !! do not use it for a hotend. It gives bad resolution at high temp. !!
+// 5 is 100K thermistor - ATC Semitec 104GT-2 (Used in ParCan & J-Head) (4.7k pullup)
+// 6 is 100k EPCOS - Not as accurate as table 1 (created using a fluke thermocouple) (4.7k pullup)
+// 7 is 100k Honeywell thermistor 135-104LAG-J01 (4.7k pullup)
+// 71 is 100k Honeywell thermistor 135-104LAF-J01 (4.7k pullup)
+// 8 is 100k 0603 SMD Vishay NTCS0603E3104FXT (4.7k pullup)
+// 9 is 100k GE Sensing AL03006-58.2K-97-G1 (4.7k pullup)
+// 10 is 100k RS thermistor 198-961 (4.7k pullup)
+// 11 is 100k beta 3950 1% thermistor (4.7k pullup)
+// 12 is 100k 0603 SMD Vishay NTCS0603E3104FXT (4.7k pullup) (calibrated for Makibox hot bed)
+// 20 is the PT100 circuit found in the Ultimainboard V2.x
+// 60 is 100k Maker's Tool Works Kapton Bed Thermistor beta=3950
+//
+//    1k ohm pullup tables - This is not normal, you would have to have changed out your 4.7k for 1k
+//                          (but gives greater accuracy and more stable PID)
+// 51 is 100k thermistor - EPCOS (1k pullup)
+// 52 is 200k thermistor - ATC Semitec 204GT-2 (1k pullup)
+// 55 is 100k thermistor - ATC Semitec 104GT-2 (Used in ParCan & J-Head) (1k pullup)
+//
+// 1047 is Pt1000 with 4k7 pullup
+// 1010 is Pt1000 with 1k pullup (non standard)
+// 147 is Pt100 with 4k7 pullup
+// 110 is Pt100 with 1k pullup (non standard)""",
+    }
+
+
 def load_outputs():
     return {
         "configuration.h": load_config_h()
@@ -433,36 +453,7 @@ ${emit(comment(BTENABLED))}$#define BTENABLED              // Enable BT interfac
 //
 //--NORMAL IS 4.7kohm PULLUP!-- 1kohm pullup can be used on hotend sensor, using correct resistor and table
 //
-//// Temperature sensor settings:
-// -2 is thermocouple with MAX6675 (only for sensor 0)
-// -1 is thermocouple with AD595
-// 0 is not used
-// 1 is 100k thermistor - best choice for EPCOS 100k (4.7k pullup)
-// 2 is 200k thermistor - ATC Semitec 204GT-2 (4.7k pullup)
-// 3 is Mendel-parts thermistor (4.7k pullup)
-// 4 is 10k thermistor !! do not use it for a hotend. It gives bad resolution at high temp. !!
-// 5 is 100K thermistor - ATC Semitec 104GT-2 (Used in ParCan & J-Head) (4.7k pullup)
-// 6 is 100k EPCOS - Not as accurate as table 1 (created using a fluke thermocouple) (4.7k pullup)
-// 7 is 100k Honeywell thermistor 135-104LAG-J01 (4.7k pullup)
-// 71 is 100k Honeywell thermistor 135-104LAF-J01 (4.7k pullup)
-// 8 is 100k 0603 SMD Vishay NTCS0603E3104FXT (4.7k pullup)
-// 9 is 100k GE Sensing AL03006-58.2K-97-G1 (4.7k pullup)
-// 10 is 100k RS thermistor 198-961 (4.7k pullup)
-// 11 is 100k beta 3950 1% thermistor (4.7k pullup)
-// 12 is 100k 0603 SMD Vishay NTCS0603E3104FXT (4.7k pullup) (calibrated for Makibox hot bed)
-// 20 is the PT100 circuit found in the Ultimainboard V2.x
-// 60 is 100k Maker's Tool Works Kapton Bed Thermistor beta=3950
-//
-//    1k ohm pullup tables - This is not normal, you would have to have changed out your 4.7k for 1k
-//                          (but gives greater accuracy and more stable PID)
-// 51 is 100k thermistor - EPCOS (1k pullup)
-// 52 is 200k thermistor - ATC Semitec 204GT-2 (1k pullup)
-// 55 is 100k thermistor - ATC Semitec 104GT-2 (Used in ParCan & J-Head) (1k pullup)
-//
-// 1047 is Pt1000 with 4k7 pullup
-// 1010 is Pt1000 with 1k pullup (non standard)
-// 147 is Pt100 with 4k7 pullup
-// 110 is Pt100 with 1k pullup (non standard)
+${@include marlin/temp_sensor_table}$
 
 ${for i in range(EXTRUDERS):}$ #define TEMP_SENSOR_${i}$ ${TEMP_SENSOR[i]}$
 ${:end-for}$
@@ -25,19 +25,68 @@
 #       MA 02110-1301, USA.
 #
 
-import sys, re
+import sys, re, ast, copy, types, hashlib, itertools
+import __builtin__
+
+#Builtins available to sandboxed templates
+safe_builtins = dict((name, getattr(__builtin__, name)) for name in (
+    'abs', 'all', 'any', 'bool', 'chr', 'cmp', 'dict', 'divmod', 'enumerate',
+    'filter', 'float', 'format', 'hex', 'int', 'isinstance', 'len', 'list',
+    'long', 'map', 'max', 'min', 'oct', 'ord', 'range', 'reduce', 'repr',
+    'reversed', 'round', 'set', 'sorted', 'str', 'sum', 'tuple', 'unichr',
+    'unicode', 'xrange', 'zip', 'True', 'False', 'None',
+    'ArithmeticError', 'IndexError', 'KeyError', 'ValueError', 'ZeroDivisionError'))
+
+#Functions specialise() may call ahead of rendering, since their result only depends on their arguments.
+#Other functions may have side effects or change between renders and are always left to the render.
+pure_functions = set(getattr(__builtin__, name) for name in (
+    'abs', 'all', 'any', 'bool', 'chr', 'cmp', 'dict', 'divmod', 'enumerate',
+    'filter', 'float', 'format', 'frozenset', 'hex', 'int', 'isinstance', 'len',
+    'list', 'long', 'map', 'max', 'min', 'oct', 'ord', 'range', 'reduce', 'repr',
+    'reversed', 'round', 'set', 'sorted', 'str', 'sum', 'tuple', 'unichr',
+    'unicode', 'xrange', 'zip'))
+
+#Attributes that expose frames, globals or code objects without a leading underscore,
+#plus str.format whose field names can reach underscore attributes
+_unsafe_attributes = set([
+    'im_class', 'im_func', 'im_self', 'func_closure', 'func_code', 'func_defaults',
+    'func_dict', 'func_globals', 'gi_code', 'gi_frame', 'f_back', 'f_builtins',
+    'f_code', 'f_globals', 'f_locals', 'tb_frame', 'tb_next', 'co_code', 'mro',
+    'format'])
+
+#Names through which template code can reach its namespace dynamically
+_dynamic_names = set(['globals', 'locals', 'vars', 'eval', 'execfile', 'dir'])
+
+#Numbers every compiled template's filename
+_serial = itertools.count(1)
+
+#Names render() binds itself, which are not read from the namespace
+render_names = frozenset(['emit', '_include', '_block'])
 
 class Templite(object):
     auto_emit = re.compile('(^[\'\"])|(^[a-zA-Z0-9_\[\]\'\"]+$)')
 
-    def __init__(self, template, start='${', end='}$'):
+    def __init__(self, template, start='${', end='}$', sandbox=False, fragments=None):
         if len(start) != 2 or len(end) != 2:
             raise ValueError('each delimiter must be two characters long')
+        if fragments is None:
+            fragments = globals()['fragments']
+        #Fragments this template uses, by include name, block default and override name
+        self.__includes, self.__defaults, self.__overrides = {}, {}, {}
+        self.__directives = None
+        if _directive_pattern(start, end).search(template):
+            self.__directives = (template, start, end, fragments)
+            template = self.__link(template, start, end, sandbox, fragments)
         delimiter = re.compile('%s(.*?)%s' % (re.escape(start), re.escape(end)), re.DOTALL)
         offset = 0
         tokens = []
-        for i, part in enumerate(delimiter.split(template)):
-            part = part.replace('\\'.join(list(start)), start)
+        #line_map[n] is the template line that generated source line n came from
+        self.line_map = [None]
+        line = 1
+        for i, raw in enumerate(delimiter.split(template)):
+            first = line
+            line += raw.count('\n')
+            part = raw.replace('\\'.join(list(start)), start)
             part = part.replace('\\'.join(list(end)), end)
             if i % 2 == 0:
                 if not part: continue
@@ -46,23 +95,114 @@ class Templite(object):
             else:
                 part = part.rstrip()
                 if not part: continue
-                if part.lstrip().startswith(':'):
+                stripped = part.lstrip()
+                if stripped.startswith(':') or self.auto_emit.match(stripped):
+                    first += part[:len(part) - len(stripped)].count('\n')
+                if stripped.startswith(':'):
                     if not offset:
                         raise SyntaxError('no block statement to terminate: ${%s}$' % part)
                     offset -= 1
-                    part = part.lstrip()[1:]
+                    part = stripped[1:]
                     if not part.endswith(':'): continue
-                elif self.auto_emit.match(part.lstrip()):
-                    part = 'emit(%s)' % part.lstrip()
+                elif self.auto_emit.match(stripped):
+                    part = 'emit(%s)' % stripped
                 lines = part.splitlines()
                 margin = min(len(l) - len(l.lstrip()) for l in lines if l.strip())
                 part = '\n'.join('\t' * offset + l[margin:] for l in lines)
                 if part.endswith(':'):
                     offset += 1
             tokens.append(part)
+            self.line_map.extend(range(first, first + part.count('\n') + 1))
         if offset:
             raise SyntaxError('%i block statement(s) not terminated' % offset)
-        self.__code = compile('\n'.join(tokens), '<templite %r>' % template[:20], 'exec')
+        self.source = '\n'.join(tokens)
+        source = self.source.encode('utf-8') if isinstance(self.source, unicode) else self.source
+        digest = hashlib.sha1(source)
+        for kind, used in (('include', self.__includes), ('default', self.__defaults),
+                           ('override', self.__overrides)):
+            for name, fragment in sorted(used.items()):
+                digest.update('\0%s %s %s' % (kind, name, fragment.digest))
+        self.digest = digest.hexdigest()
+        self.sandbox = sandbox
+        #Unique, so tracebacks and profilers can tell templates that start alike apart
+        self.filename = '<templite %i %r>' % (next(_serial), template[:20])
+        self.__code = compile(self.source, self.filename, 'exec')
+        self.__names = None
+        if sandbox:
+            check_sandbox(self.source)
+
+    def __link(self, template, start, end, sandbox, fragments):
+        #Replaces directives with calls to the compiled fragments they name
+        parts, overrides, extends = parse_directives(template, start, end)
+        code = lambda text: start + text + end
+        if extends is not None:
+            if any(kind == 'text' and value.strip() for kind, value, body in parts):
+                raise SyntaxError('only @override blocks may follow @extends %r' % extends)
+            parts = [('include', extends, None)]
+        for name, body in overrides.items():
+            self.__overrides[name] = self.__use(fragments.compile(body, start, end, sandbox))
+        text = []
+        for kind, value, body in parts:
+            if kind == 'text':
+                text.append(value)
+            elif kind == 'include':
+                self.__includes[value] = self.__use(fragments.template(value, start, end, sandbox))
+                text.append(code('_include(%r)' % value))
+            else:
+                default = self.__use(fragments.compile(body, start, end, sandbox))
+                self.__defaults[default.digest] = default
+                #Keep the line count so line_map still points into the template
+                text.append(code('_block(%r, %r)%s' % (value, default.digest, '\n' * body.count('\n'))))
+        return ''.join(text)
+
+    def __use(self, fragment):
+        #Fragments run in this template's namespace, so their own fragments must be reachable too
+        for name, used in fragment.__includes.items():
+            self.__includes.setdefault(name, used)
+        self.__defaults.update(fragment.__defaults)
+        for name, used in fragment.__overrides.items():
+            self.__overrides.setdefault(name, used)
+        return fragment
+
+    def expanded(self):
+        """
+        returns the template text with every directive replaced by the text
+        it stands for, e.g. for precompile.py and importer.py.
+        """
+        if self.__directives is None:
+            return None
+        template, start, end, fragments = self.__directives
+        return fragments.expand(template, start, end)
+
+    @property
+    def names(self):
+        """
+        the names the template reads from its namespace, or None when the
+        template can reach its namespace dynamically (globals(), eval, ...).
+        """
+        if self.__names is None:
+            self.__analyse()
+        return None if self.__names is False else self.__names
+
+    def __analyse(self):
+        tree = ast.parse(self.source)
+        loaded, stored = free_names(tree)
+        nodes = list(ast.walk(tree))
+        #Only templates with print statements need sys.stdout redirected while rendering
+        self.__uses_print = any(isinstance(node, ast.Print) for node in nodes)
+        if loaded & _dynamic_names or any(isinstance(node, ast.Exec) for node in nodes):
+            self.__names = False
+        else:
+            self.__names = frozenset(loaded) - render_names
+        for fragment in self.__fragments():
+            if fragment.names is None:
+                self.__names = False
+            elif self.__names is not False:
+                self.__names |= fragment.names
+            self.__uses_print |= fragment.__uses_print
+
+    def __fragments(self):
+        return self.__includes.values() + self.__defaults.values() + self.__overrides.values()
 
     def render(self, __namespace=None, **kw):
         """
@@ -70,18 +210,540 @@ class Templite(object):
         __namespace - a dictionary serving as a namespace for evaluation
         **kw - keyword arguments which are added to the namespace
         """
-        namespace = {}
-        if __namespace: namespace.update(__namespace)
+        names = self.names
+        if names is None:
+            namespace = {}
+            if __namespace: namespace.update(__namespace)
+        elif __namespace:
+            #Only copy what the template reads
+            namespace = dict((name, __namespace[name]) for name in names if name in __namespace)
+        else:
+            namespace = {}
         if kw: namespace.update(kw)
-        namespace['emit'] = self.write
+        output = Output()
+        namespace['emit'] = output.write
+        if self.sandbox:
+            namespace['__builtins__'] = safe_builtins
+        if self.__directives is not None:
+            includes, defaults, overrides = self.__includes, self.__defaults, self.__overrides
+            namespace['_include'] = lambda name: eval(includes[name].__code, namespace)
+            namespace['_block'] = lambda name, default: eval(overrides.get(name, defaults[default]).__code,
+                                                             namespace)
+
+        if self.__uses_print:
+            __stdout = sys.stdout
+            sys.stdout = output
+            try:
+                eval(self.__code, namespace)
+            finally:
+                sys.stdout = __stdout
+        else:
+            eval(self.__code, namespace)
+        return ''.join(output)
+
+    def specialise(self, fixed, varying=()):
+        """
+        returns a SpecialisedTemplate for namespaces that all share the
+        values in fixed. Expressions reading only fixed names are rendered to
+        text now, blocks with fixed conditions are chosen, and loops over
+        fixed sequences are unrolled, leaving code only for the rest. Names
+        the template changes in place (x[0] = 1, x.append(2)) are never fixed.
+        Only functions in pure_functions are called now; calls to any other
+        function are left to each render.
+        fixed - a dictionary of names (settings and helpers) to their values
+        varying - names that will be given at render time; builtins of the
+                  same name are not folded
+        """
+        builtins = safe_builtins if self.sandbox else __builtin__.__dict__
+        if self.__directives is None:
+            tree = ast.parse(self.source)
+        else:
+            template, start, end, fragments = self.__directives
+            tree = ast.parse(Templite(self.expanded(), start, end, self.sandbox, fragments).source)
+        #Values the template changes in place are read from each namespace. Any of them could be an alias
+        #of another value, so once something is changed in place only immutable values are fixed.
+        mutated = _mutated_names(tree)
+        fixed = dict((name, value) for name, value in fixed.items()
+                     if name not in mutated and (not mutated or _immutable(value)))
+        specialiser = _Specialiser(fixed, builtins, set(varying) | mutated, mutated)
+        tree.body = specialiser.body(tree.body)
+        specialiser.prune(tree)
+        return SpecialisedTemplate(tree, fixed, self.sandbox, specialiser.folded)
+
 
-        __stdout = sys.stdout
-        sys.stdout = self
-        self.__output = []
-        eval(self.__code, namespace)
-        sys.stdout = __stdout
-        return ''.join(self.__output)
+def _directive_pattern(start, end):
+    return re.compile(r'%s\s*@(\w+)(?:\s+([\w./-]+))?\s*%s' % (re.escape(start), re.escape(end)))
+
+
+def parse_directives(template, start='${', end='}$'):
+    """
+    splits template text at its top-level directives. Returns (parts,
+    overrides, extends): parts is a list of ('text', text, None),
+    ('include', name, None) and ('block', name, default text) tuples,
+    overrides maps block names to their @override text and extends is the
+    name given to @extends or None. Directives:
+        ${@include name}$                   the fragment registered as name
+        ${@block name}$ ... ${@end}$        text a template can override
+        ${@extends name}$                   render fragment name instead,
+        ${@override name}$ ... ${@end}$     with these blocks replaced
+    Blocks nested inside others are parsed when their body is compiled.
+    """
+    parts, overrides, extends = [], {}, None
+    depth = 0
+    position = 0
+    for match in _directive_pattern(start, end).finditer(template):
+        directive, name = match.groups()
+        if directive not in ('include', 'block', 'override', 'extends', 'end'):
+            raise SyntaxError('unknown template directive @%s' % directive)
+        if directive != 'end' and not name:
+            raise SyntaxError('@%s needs a name' % directive)
+        if directive in ('block', 'override'):
+            if not depth:
+                parts.append(('text', template[position:match.start()], None))
+                opened, body_start = (directive, name), match.end()
+            depth += 1
+        elif directive == 'end':
+            if not depth:
+                raise SyntaxError('@end without @block or @override')
+            depth -= 1
+            if not depth:
+                if opened[0] == 'block':
+                    parts.append(('block', opened[1], template[body_start:match.start()]))
+                else:
+                    overrides[opened[1]] = template[body_start:match.start()]
+        elif not depth:
+            parts.append(('text', template[position:match.start()], None))
+            if directive == 'include':
+                parts.append(('include', name, None))
+            elif extends is not None:
+                raise SyntaxError('@extends given twice')
+            else:
+                extends = name
+        else:
+            continue
+        if not depth:
+            position = match.end()
+    if depth:
+        raise SyntaxError('%i @block/@override not closed with @end' % depth)
+    parts.append(('text', template[position:], None))
+    return [part for part in parts if part[0] != 'text' or part[1]], overrides, extends
+
+
+class FragmentRegistry(object):
+    """
+    named pieces of template text that templates pull in with directives
+    (see parse_directives). Every distinct text is compiled once and the
+    compiled Templite is shared by all the templates and outputs using it.
+    """
+    def __init__(self):
+        self.sources = {}
+        self.__compiled = {}
+        self.__compiling = set()
+
+    def register(self, name, text):
+        self.sources[name] = text
+
+    def update(self, fragments):
+        self.sources.update(fragments)
+
+    def load(self, module):
+        """
+        registers the fragments a template module returns from
+        load_fragments(), if it has one.
+        """
+        if hasattr(module, 'load_fragments'):
+            self.update(module.load_fragments())
+
+    def text(self, name):
+        try:
+            return self.sources[name]
+        except KeyError:
+            raise SyntaxError('no template fragment named %r' % name)
+
+    def template(self, name, start='${', end='}$', sandbox=False):
+        return self.compile(self.text(name), start, end, sandbox)
+
+    def compile(self, text, start='${', end='}$', sandbox=False):
+        source = text.encode('utf-8') if isinstance(text, unicode) else text
+        key = (hashlib.sha1(source).hexdigest(), start, end, sandbox)
+        try:
+            return self.__compiled[key]
+        except KeyError:
+            pass
+        if key in self.__compiling:
+            raise SyntaxError('template fragment includes itself')
+        self.__compiling.add(key)
+        try:
+            compiled = self.__compiled[key] = Templite(text, start, end, sandbox, self)
+        finally:
+            self.__compiling.discard(key)
+        return compiled
+
+    def expand(self, template, start='${', end='}$', overrides=None, depth=0):
+        """
+        returns template with every directive replaced by the text it
+        stands for. The result renders the same as the template itself.
+        """
+        if depth > 50:
+            raise SyntaxError('template fragments include each other too deeply')
+        parts, own, extends = parse_directives(template, start, end)
+        #Overrides from the extending template win over the ones it extends
+        own.update(overrides or {})
+        if extends is not None:
+            return self.expand(self.text(extends), start, end, own, depth + 1)
+        text = []
+        for kind, value, body in parts:
+            if kind == 'text':
+                text.append(value)
+            elif kind == 'include':
+                text.append(self.expand(self.text(value), start, end, own, depth + 1))
+            else:
+                text.append(self.expand(own.get(value, body), start, end, own, depth + 1))
+        return ''.join(text)
+
+
+#The registry templates use unless they are given another one
+fragments = FragmentRegistry()
+
+
+class SpecialisedTemplate(object):
+    """
+    a template partially evaluated against fixed values by
+    Templite.specialise, with the same render interface as Templite.
+    """
+    def __init__(self, tree, fixed, sandbox, folded):
+        ast.fix_missing_locations(tree)
+        self.__code = compile(tree, '<specialised templite>', 'exec')
+        self.sandbox = sandbox
+        #How many expressions were rendered ahead of time
+        self.folded = folded
+        loaded, stored = free_names(tree)
+        self.statements = sum(1 for node in ast.walk(tree) if isinstance(node, ast.stmt))
+        self.__uses_print = any(isinstance(node, ast.Print) for node in ast.walk(tree))
+        #Fixed values the remaining code still reads are bound here
+        self.__fixed = dict((name, fixed[name]) for name in loaded if name in fixed)
+        self.names = frozenset(loaded - set(fixed)) - render_names
+        digest = hashlib.sha1(ast.dump(tree))
+        digest.update(repr(sorted(self.__fixed.items())))
+        self.digest = digest.hexdigest()
+
+    def render(self, __namespace=None, **kw):
+        namespace = dict(self.__fixed)
+        if __namespace:
+            namespace.update((name, __namespace[name]) for name in self.names if name in __namespace)
+        if kw: namespace.update((name, value) for name, value in kw.items() if name not in self.__fixed)
+        output = Output()
+        namespace['emit'] = output.write
+        if self.sandbox:
+            namespace['__builtins__'] = safe_builtins
 
+        if self.__uses_print:
+            __stdout = sys.stdout
+            sys.stdout = output
+            try:
+                eval(self.__code, namespace)
+            finally:
+                sys.stdout = __stdout
+        else:
+            eval(self.__code, namespace)
+        return ''.join(output)
+
+
+#Loops longer than this are left as loops
+unroll_limit = 256
+
+#Types whose values can be written back into code as literals
+_literal_types = (int, long, float, str, bool, type(None))
+
+#Types whose values template code cannot change in place
+_immutable_types = _literal_types + (unicode, complex, type, types.FunctionType, types.BuiltinFunctionType)
+
+
+class _Specialiser(object):
+    #Partially evaluates a list of template statements against known values
+
+    def __init__(self, fixed, builtins, varying, mutated=()):
+        self.known = dict(fixed)
+        self.known.pop('emit', None)
+        self.builtins = builtins
+        #Names bound by the template or the namespace whose value is not known here
+        self.unknown = set(varying) - set(fixed)
+        #Names the template changes in place are never known, and then only immutable values are
+        self.mutated = set(mutated)
+        self.folded = 0
+        self.dropped = set()
+
+    def body(self, statements):
+        result = []
+        for statement in statements:
+            result.extend(self.statement(statement))
+        result = _merge_text(result)
+        return result or [ast.Pass()]
+
+    def statement(self, node):
+        if _is_emit(node):
+            node.value.args = [self.text(arg) for arg in node.value.args]
+            return [node]
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            name = node.targets[0].id
+            found, value = self.evaluate(node.value)
+            if found and self.bindable(name, value):
+                self.bind(name, value)
+                self.dropped.add(node)
+            else:
+                self.forget(node)
+            return [node]
+        if isinstance(node, ast.If):
+            found, value = self.evaluate(node.test)
+            if found:
+                try:
+                    taken = node.body if value else node.orelse
+                except Exception:
+                    return [self.branches(node)]
+                return self.body(taken) if taken else []
+            return [self.branches(node)]
+        if isinstance(node, ast.For):
+            unrolled = self.unroll(node)
+            if unrolled is not None:
+                return unrolled
+            self.forget(node)
+            known = dict(self.known)
+            node.body = self.body(node.body)
+            self.known = known
+            if node.orelse:
+                node.orelse = self.body(node.orelse)
+            self.forget(node)
+            return [node]
+        self.forget(node)
+        return [node]
+
+    def prune(self, tree):
+        """
+        removes assignments of known values to names no remaining code reads.
+        """
+        loaded = free_names(tree)[0]
+        for node in ast.walk(tree):
+            for field in ('body', 'orelse', 'finalbody'):
+                statements = getattr(node, field, None)
+                if isinstance(statements, list) and statements:
+                    kept = [statement for statement in statements if statement not in self.dropped
+                            or statement.targets[0].id in loaded]
+                    setattr(node, field, (kept or [ast.Pass()]) if field == 'body' else kept)
+        return tree
+
+    def branches(self, node):
+        #Both branches may run: names either one binds are unknown afterwards
+        known, unknown = self.known, self.unknown
+        self.known, self.unknown = dict(known), set(unknown)
+        node.body = self.body(node.body)
+        self.known, self.unknown = dict(known), set(unknown)
+        node.orelse = self.body(node.orelse) if node.orelse else []
+        self.known, self.unknown = known, unknown
+        self.forget(node)
+        return node
+
+    def unroll(self, node):
+        if not isinstance(node.target, ast.Name) or node.target.id in self.mutated or any(
+                isinstance(child, (ast.Break, ast.Continue)) for child in ast.walk(node)):
+            return None
+        found, values = self.evaluate(node.iter)
+        if not found:
+            return None
+        try:
+            values = list(values)
+        except Exception:
+            return None
+        if len(values) > unroll_limit or not all(type(value) in _literal_types for value in values):
+            return None
+        result = []
+        for value in values:
+            #The loop variable is still assigned, in case code left in the body reads it
+            assign = ast.Assign([ast.Name(node.target.id, ast.Store())], _literal(value))
+            self.dropped.add(assign)
+            self.bind(node.target.id, value)
+            result.append(assign)
+            result.extend(self.body(copy.deepcopy(node.body)))
+        if node.orelse:
+            result.extend(self.body(node.orelse))
+        return result
+
+    def text(self, node):
+        #Returns a Str node for the text emit would write for node, or node itself
+        if isinstance(node, ast.Str):
+            return node
+        found, value = self.evaluate(node)
+        if found:
+            try:
+                text = str(value)
+            except Exception:
+                return node
+            self.folded += 1
+            return ast.copy_location(ast.Str(text), node)
+        return node
+
+    def evaluate(self, node):
+        """
+        returns (True, value) when node only reads known names and calls
+        pure functions by name, else (False, None).
+        """
+        if isinstance(node, ast.Str):
+            return True, node.s
+        if isinstance(node, ast.Num):
+            return True, node.n
+        loaded, stored = free_names(node)
+        if stored or 'emit' in loaded or loaded & _dynamic_names:
+            return False, None
+        namespace = {}
+        for name in loaded:
+            if name in self.known:
+                value = namespace[name] = self.known[name]
+            elif name in self.unknown or name not in self.builtins:
+                return False, None
+            else:
+                value = self.builtins[name]
+            #Whether called here or passed to map() or sorted(), only pure functions run now
+            if callable(value) and not _pure(value):
+                return False, None
+        for child in ast.walk(node):
+            if isinstance(child, (ast.Yield, ast.Repr)):
+                return False, None
+            #Method calls could change their object; only string methods are safe
+            if isinstance(child, ast.Call) and not isinstance(child.func, ast.Name) and not (
+                    isinstance(child.func, ast.Attribute) and isinstance(child.func.value, ast.Str)):
+                return False, None
+        namespace['__builtins__'] = self.builtins
+        try:
+            expression = ast.fix_missing_locations(ast.Expression(copy.deepcopy(node)))
+            return True, eval(compile(expression, '<specialise>', 'eval'), namespace)
+        except Exception:
+            return False, None
+
+    def bindable(self, name, value):
+        return not self.mutated or (name not in self.mutated and _immutable(value))
+
+    def bind(self, name, value):
+        self.known[name] = value
+        self.unknown.discard(name)
+
+    def forget(self, node):
+        for name in free_names(node)[1]:
+            self.known.pop(name, None)
+            self.unknown.add(name)
+
+
+def _pure(function):
+    try:
+        return function in pure_functions
+    except TypeError:
+        return False #Unhashable callable objects
+
+
+def _immutable(value):
+    if isinstance(value, (tuple, frozenset)):
+        return all(_immutable(item) for item in value)
+    return type(value) in _immutable_types
+
+
+def _root_name(node):
+    #The name at the bottom of x.a[0].b, or None
+    while isinstance(node, (ast.Attribute, ast.Subscript)):
+        node = node.value
+    return node.id if isinstance(node, ast.Name) else None
+
+
+def _mutated_names(tree):
+    """
+    returns the names whose values code in tree may change in place: the
+    bases of subscript and attribute assignments or deletions, and of
+    method calls other than on string literals.
+    """
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Attribute, ast.Subscript)) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            names.add(_root_name(node))
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+            names.add(_root_name(node.func.value))
+    names.discard(None)
+    return names
+
+
+def _is_emit(node):
+    return isinstance(node, ast.Expr) and isinstance(node.value, ast.Call) and \
+        isinstance(node.value.func, ast.Name) and node.value.func.id == 'emit'
+
+
+def _literal(value):
+    if isinstance(value, (bool, type(None))):
+        return ast.Name(repr(value), ast.Load())
+    if isinstance(value, str):
+        return ast.Str(value)
+    return ast.Num(value)
+
+
+def _merge_text(statements):
+    #Joins runs of emit calls into one call, with neighbouring constant text joined
+    result = []
+    for node in statements:
+        if _is_emit(node) and result and _is_emit(result[-1]) and \
+                not any(call.keywords or call.starargs or call.kwargs for call in (node.value, result[-1].value)):
+            args = result[-1].value.args
+            for arg in node.value.args:
+                if isinstance(arg, ast.Str) and args and isinstance(args[-1], ast.Str):
+                    args[-1] = ast.copy_location(ast.Str(args[-1].s + arg.s), args[-1])
+                else:
+                    args.append(arg)
+        else:
+            result.append(node)
+    return result
+
+
+class Output(list):
+    """
+    collects rendered text. Each render gets its own Output, so one
+    compiled template can be rendered by several threads at once (templates
+    using print statements still redirect the process-wide sys.stdout).
+    """
     def write(self, *args):
         for a in args:
-            self.__output.append(str(a))
+            self.append(str(a))
+
+
+def free_names(source):
+    """
+    returns (loaded, stored): the sets of names the given Python source (or
+    parsed ast) reads and binds. Names that are loaded but never stored must
+    come from the namespace or builtins.
+    """
+    if isinstance(source, basestring):
+        source = ast.parse(source)
+    loaded, stored = set(), set()
+    for node in ast.walk(source):
+        if isinstance(node, ast.Name):
+            if isinstance(node.ctx, ast.Load):
+                loaded.add(node.id)
+            else:
+                stored.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            stored.add(node.name)
+        elif isinstance(node, ast.alias):
+            stored.add((node.asname or node.name).split('.')[0])
+    return loaded, stored
+
+
+def check_sandbox(source):
+    """
+    raises SyntaxError if template code uses anything that could escape the
+    restricted builtins: imports, exec, names and attributes starting with an
+    underscore (e.g. __class__) or introspection attributes such as func_globals.
+    """
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, (ast.Import, ast.ImportFrom, ast.Exec)):
+            raise SyntaxError('%s is not allowed in sandboxed templates (line %i)'
+                              % (type(node).__name__.lower(), node.lineno))
+        elif isinstance(node, ast.Name) and node.id.startswith('__'):
+            raise SyntaxError('name %r is not allowed in sandboxed templates (line %i)'
+                              % (node.id, node.lineno))
+        elif isinstance(node, ast.Attribute) and (node.attr.startswith('_') or
+                                                  node.attr in _unsafe_attributes):
+            raise SyntaxError('attribute %r is not allowed in sandboxed templates (line %i)'
+                              % (node.attr, node.lineno))
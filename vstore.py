@@ -1,21 +1,98 @@
+import weakref
 import operator
+import threading
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import instrument
+
+
+class Binding(object):
+    """
+    a callback registered with add_binding. remove() unregisters it in
+    constant time. A weak binding only holds a weak reference to its callback
+    (or to the object of a bound method) and removes itself once that object
+    has been garbage collected.
+    """
+    __slots__ = ("bindings", "callback", "function")
+
+    def __init__(self, bindings, callback, weak=False):
+        self.bindings = bindings
+        self.function = None
+        if weak:
+            target = getattr(callback, "im_self", None)
+            if target is None:
+                target = callback
+            else:
+                self.function = callback.im_func
+            self.callback = weakref.ref(target, self._expired)
+        else:
+            self.callback = callback
+        bindings[self] = None
+
+    def __call__(self, key, value):
+        if self.function is not None:
+            target = self.callback()
+            if target is not None:
+                self.function(target, key, value)
+        elif isinstance(self.callback, weakref.ref):
+            callback = self.callback()
+            if callback is not None:
+                callback(key, value)
+        else:
+            self.callback(key, value)
+
+    def remove(self):
+        self.bindings.pop(self, None)
+
+    def _expired(self, ref):
+        self.remove()
+
+
+def _add_binding(bindings, key, callback, weak):
+    #bindings maps each key to an OrderedDict used as an ordered set of Binding handles
+    try:
+        keyed = bindings[key]
+    except KeyError:
+        keyed = bindings[key] = OrderedDict()
+    return Binding(keyed, callback, weak)
+
 
 class VariableStore(dict):
     def __init__(self):
         self.bindings = dict()
+        self.watchers = OrderedDict()
         
     def __setitem__(self, key, value):
         print "setting: ", key, value
+        current = self.get(key)
+        if isinstance(current, Column) and not isinstance(value, Column):
+            current[:] = value #Keep the typed storage, e.g. when loading saved lists
+            value = current
         super(VariableStore, self).__setitem__(key, value)
+        for watcher in self.watchers.keys():
+            watcher([key], value)
         try:
-            for binding in self.bindings[key]:
+            bindings = self.bindings[key]
+            if instrument.enabled:
+                instrument.count("binding dispatches", key, len(bindings))
+            for binding in bindings.keys():
                 binding(key, value)
         except KeyError:
             pass
             
     def update(self, *args, **kwargs):
+        """
+        sets every given key and returns the list of keys whose value was
+        added or changed.
+        """
+        changed = []
         for k, v in dict(*args, **kwargs).items():
+            if k not in self or self[k] != v:
+                changed.append(k)
             self[k] = v
+        return changed
             
     def getr(self, keys):
         if isinstance(keys, basestring):
@@ -26,17 +103,204 @@ class VariableStore(dict):
         if isinstance(keys, basestring):
             keys = [keys]            
         reduce(operator.getitem, keys[:-1], self)[keys[-1]] = value
+        if len(keys) > 1:
+            #Nested writes bypass __setitem__, so watchers are told here
+            for watcher in self.watchers.keys():
+                watcher(list(keys), value)
     
     def clear(self):
         super(VariableStore, self).clear()
         self.bindings.clear()
         
-    def add_binding(self, key, binding, run=False):
-        try:
-            self.bindings[key].append(binding)
-        except KeyError:
-            self.bindings[key] = [binding]
+    def add_binding(self, key, binding, run=False, weak=False):
+        """
+        calls binding(key, value) whenever key is set and returns a Binding
+        handle whose remove() unregisters it.
+        weak - only hold a weak reference to binding, see Binding
+        """
+        handle = _add_binding(self.bindings, key, binding, weak)
         if run:
             binding(key, self[key])
+        return handle
+
+    def add_watcher(self, watcher, weak=False):
+        """
+        calls watcher(path, value) for every write through __setitem__ or
+        setr, where path is the list of keys written. Unlike bindings,
+        watchers survive clear(). Returns a Binding handle.
+        """
+        return Binding(self.watchers, watcher, weak)
+
+    def binding_counts(self):
+        """
+        returns a dictionary of key to the number of registered bindings,
+        including the bindings of Column values as "KEY[index]" and "KEY[*]".
+        """
+        counts = dict((key, len(bindings)) for key, bindings in self.bindings.items() if bindings)
+        for key, value in self.items():
+            if isinstance(value, Column):
+                for index, bindings in value.bindings.items():
+                    if bindings:
+                        counts["%s[%s]" % (key, "*" if index is None else index)] = len(bindings)
+        return counts
+
+
+class Column(object):
+    """
+    an array backed list of values of a single type (int, float or bool).
+    Reads and writes work like a list; every write calls the bindings added
+    for the written index with (index, value).
+    """
+    typecodes = {int: "l", float: "d", bool: "b"}
+
+    def __init__(self, kind, values=()):
+        self.kind = kind
+        self.bindings = dict()
+        self._data = array(self.typecodes[kind], [kind(v) for v in values])
+
+    def __len__(self):
+        return len(self._data)
+
+    def __iter__(self):
+        if self.kind is bool:
+            return (bool(v) for v in self._data)
+        return iter(self._data)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return Column(self.kind, self._data[index])
+        if self.kind is bool:
+            return bool(self._data[index])
+        return self._data[index]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self._data))
+            size = len(self._data)
+            self._data[index] = array(self._data.typecode, [self.kind(v) for v in value])
+            if step == 1 and len(self._data) != size:
+                stop = max(size, len(self._data))
+            self._notify(range(start, min(stop, len(self._data)), step))
+        else:
+            self._data[index] = self.kind(value)
+            self._notify([index])
+
+    def __delitem__(self, index):
+        del self._data[index]
+
+    def __eq__(self, other):
+        try:
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        except TypeError:
+            return False
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "Column(%s, %r)" % (self.kind.__name__, self.tolist())
+
+    def append(self, value):
+        self._data.append(self.kind(value))
+        self._notify([len(self._data) - 1])
+
+    def extend(self, values):
+        start = len(self._data)
+        self._data.extend(array(self._data.typecode, [self.kind(v) for v in values]))
+        self._notify(range(start, len(self._data)))
+
+    def tolist(self):
+        return list(self)
+
+    def add_binding(self, index, binding, run=False, weak=False):
+        """
+        calls binding(index, value) whenever index is written and returns a
+        Binding handle whose remove() unregisters it.
+        index - the index to watch, or None to watch every index
+        """
+        handle = _add_binding(self.bindings, index, binding, weak)
+        if run and index is not None:
+            binding(index, self[index])
+        return handle
+
+    def _notify(self, indexes):
+        if not self.bindings:
+            return
+        for index in indexes:
+            value = self[index]
+            for binding in self.bindings.get(index, {}).keys():
+                binding(index, value)
+            for binding in self.bindings.get(None, {}).keys():
+                binding(index, value)
+
+
+class IndexedGroup(object):
+    """
+    columnar storage for settings that repeat per index, such as one record
+    per extruder. fields is a list of (name, type, default) tuples; each field
+    becomes a Column stored under its own name so templates and widgets keep
+    addressing it as NAME[i].
+    """
+    def __init__(self, fields):
+        self.fields = fields
+        self.columns = [(name, Column(kind)) for name, kind, default in fields]
+
+    def __len__(self):
+        return min(len(column) for name, column in self.columns) if self.columns else 0
+
+    def __getitem__(self, index):
+        return dict((name, column[index]) for name, column in self.columns)
+
+    def __setitem__(self, index, record):
+        for name, column in self.columns:
+            if name in record:
+                column[index] = record[name]
+
+    def install(self, store, count=None):
+        """
+        puts every column into store. If count is a store key the group grows
+        to hold at least that many records whenever the key changes.
+        """
+        for name, column in self.columns:
+            store[name] = column
+        if count is not None:
+            store.add_binding(count, self._count_changed, True)
+
+    def reserve(self, count):
+        for (name, column), (_, kind, default) in zip(self.columns, self.fields):
+            if len(column) < count:
+                column.extend([default] * (count - len(column)))
+
+    def _count_changed(self, key, count):
+        self.reserve(count)
+
+
+def to_json(obj):
+    """json default hook for values json cannot serialise on its own."""
+    if isinstance(obj, Column):
+        return obj.tolist()
+    raise TypeError("%r is not JSON serializable" % obj)
+
+
+instance = VariableStore()
+_local = threading.local()
+
+
+def current():
+    """
+    returns the store that templates and gui parts should use on this thread:
+    the one activated with using(), otherwise the global instance.
+    """
+    store = getattr(_local, "store", None)
+    return instance if store is None else store
+
 
-instance = VariableStore()
\ No newline at end of file
+@contextmanager
+def using(store):
+    """makes store the current store on this thread for the duration of a with block."""
+    previous = getattr(_local, "store", None)
+    _local.store = store
+    try:
+        yield store
+    finally:
+        _local.store = previous